@@ -0,0 +1,184 @@
+import hashlib
+import json
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition, require_GET, require_POST
+from .forms import TaskForm
+from .models import Goals, Tasks
+from .fragments import bump_user_version
+from .search import search_goals
+from .transfer import EXPORT_FORMATS, IMPORT_FORMATS, TransferError, import_goals
+
+
+MAX_BULK_TASKS = 500 # 1リクエストで扱うタスク数の上限
+
+API_VERSION = 1 # 返す項目を変えたら上げる（古いETagが一致しないようにする）
+GOAL_FIELDS = ('id', 'goal_title', 'goal_detail', 'goal_condition', 'created_at', 'upload_at')
+TASK_FIELDS = ('id', 'task_title', 'task_condition', 'task_priority', 'task_due', 'upload_at')
+
+
+def _ids(value):
+    if not isinstance(value, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in value): # trueは1として扱わない
+        raise ValueError
+    return value
+
+
+@login_required
+@require_POST
+def tasks_bulk(request, pk):
+    """1つの夢のタスクをまとめて作成・並べ替え・完了・削除する。
+
+    リクエスト本文(JSON):
+        {"create": [{"task_title": ..., "task_priority": ..., "task_due": ..., "task_condition": ...}],
+         "reorder": [task_id, ...],  # この順にtask_priorityを0から振り直す
+         "complete": [task_id, ...],
+         "delete": [task_id, ...]}
+    """
+    # 所有者の確認は夢ごとに1回だけ行う
+    goal = get_object_or_404(Goals.objects.only('id'), pk=pk, user=request.user)
+    try:
+        payload = json.loads(request.body)
+        creates = payload.get('create', [])
+        reorder = _ids(payload.get('reorder', []))
+        complete = _ids(payload.get('complete', []))
+        delete = _ids(payload.get('delete', []))
+        if not isinstance(creates, list):
+            raise ValueError
+    except (ValueError, AttributeError):
+        return JsonResponse({'errors': '不正なリクエストです'}, status=400)
+    if len(creates) + len(reorder) + len(complete) + len(delete) > MAX_BULK_TASKS:
+        return JsonResponse({'errors': f'一度に操作できるのは{MAX_BULK_TASKS}件までです'}, status=400)
+
+    new_tasks = []
+    errors = {}
+    for i, data in enumerate(creates):
+        form = TaskForm(data if isinstance(data, dict) else {})
+        if form.is_valid():
+            task = form.save(commit=False)
+            task.goals = goal
+            new_tasks.append(task)
+        else:
+            errors[i] = form.errors.get_json_data()
+    if errors:
+        return JsonResponse({'errors': {'create': errors}}, status=400)
+
+    now = timezone.now()
+    goal_tasks = Tasks.objects.filter(goals=goal)
+    with transaction.atomic():
+        created = Tasks.objects.bulk_create(new_tasks)
+        reordered = 0
+        if reorder:
+            priorities = {task_id: i for i, task_id in enumerate(reorder)}
+            tasks = list(goal_tasks.filter(id__in=reorder).only('id'))
+            for task in tasks:
+                task.task_priority = priorities[task.id]
+                task.upload_at = now
+            reordered = Tasks.objects.bulk_update(tasks, ['task_priority', 'upload_at'])
+        completed = goal_tasks.filter(id__in=complete).update(task_condition=True, upload_at=now) if complete else 0
+        deleted = goal_tasks.filter(id__in=delete).delete()[0] if delete else 0
+        # bulk_create/bulk_update/update はシグナルを送らないので、画面のキャッシュはここで無効にする
+        transaction.on_commit(lambda: bump_user_version(request.user.pk))
+
+    return JsonResponse({
+        'created': [task.pk for task in created],
+        'reordered': reordered,
+        'completed': completed,
+        'deleted': deleted,
+    })
+
+
+# 読み出し用のAPI。ETagは(件数, 最終更新日時)から作るので、変更が無ければ集計1回だけで304を返す
+def make_etag(kind, user_id, count, last_modified):
+    payload = f'{API_VERSION}:{kind}:{user_id}:{count}:{last_modified.isoformat() if last_modified else ""}'
+    return quote_etag(hashlib.sha256(payload.encode()).hexdigest()[:32])
+
+
+def goals_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    stats = Goals.objects.filter(user=request.user).aggregate(count=Count('id'), last=Max('upload_at'))
+    return make_etag('goals', request.user.pk, stats['count'], stats['last'])
+
+
+def tasks_etag(request, pk):
+    if not request.user.is_authenticated:
+        return None
+    # 夢が無い・他人の夢なら行が返らないので、ETagを付けずにビューで404にする
+    stats = Goals.objects.filter(pk=pk, user=request.user).values('pk').annotate(
+        count=Count('tasks'), last=Max('tasks__upload_at'),
+    ).first()
+    if stats is None:
+        return None
+    return make_etag(f'tasks-{pk}', request.user.pk, stats['count'], stats['last'])
+
+
+def api_response(data):
+    response = JsonResponse(data)
+    patch_cache_control(response, private=True, no_cache=True) # 毎回If-None-Matchで確かめてもらう
+    return response
+
+
+@login_required
+@require_GET
+@condition(etag_func=goals_etag)
+def goals_list(request):
+    """ログイン中のユーザーの夢の一覧。{"goals": [{"id": ..., "goal_title": ..., ...}]}"""
+    goals = Goals.objects.filter(user=request.user).order_by('-created_at', '-id').values(*GOAL_FIELDS)
+    return api_response({'goals': list(goals)})
+
+
+@login_required
+@require_GET
+@condition(etag_func=tasks_etag)
+def goal_tasks(request, pk):
+    """1つの夢のタスクを表示順で返す。{"goal": id, "tasks": [{"id": ..., "task_title": ..., ...}]}"""
+    if not Goals.objects.filter(pk=pk, user=request.user).exists():
+        raise Http404('夢が見つかりません')
+    tasks = Tasks.objects.filter(goals_id=pk).order_by('task_priority', 'task_due', 'id').values(*TASK_FIELDS)
+    return api_response({'goal': pk, 'tasks': list(tasks)})
+
+
+@login_required
+@require_GET
+def goals_search(request):
+    """夢のタイトル・詳細・タスクのタイトルを検索する。{"goals": [...]}（GOAL_FIELDSの項目、新しい順に最大100件）"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return api_response({'goals': []})
+    goals = search_goals(request.user, query).order_by('-created_at', '-id').values(*GOAL_FIELDS)[:100]
+    return api_response({'goals': list(goals)})
+
+
+@login_required
+@require_GET
+def goals_export(request, fmt):
+    """夢とタスクをCSVかJSON Linesで書き出す。少しずつ読んで送るので、件数が多くてもメモリを使わない"""
+    if fmt not in EXPORT_FORMATS:
+        raise Http404('対応していない形式です')
+    rows, content_type = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(rows(request.user), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="goals_{timezone.localdate():%Y%m%d}.{fmt}"'
+    return response
+
+
+@login_required
+@require_POST
+def goals_import(request):
+    """goals_exportの形式のファイル(file)を読み込んで夢とタスクを追加する。形式は拡張子か format で指定する"""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'errors': 'ファイルを指定してください'}, status=400)
+    fmt = request.POST.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+    if fmt not in IMPORT_FORMATS:
+        return JsonResponse({'errors': '対応していない形式です（csv / jsonl）'}, status=400)
+    try:
+        goals, tasks = import_goals(request.user, upload, fmt)
+    except TransferError as e:
+        return JsonResponse({'errors': e.messages}, status=400)
+    return JsonResponse({'goals': goals, 'tasks': tasks})
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from . import signals # シグナルの受信側を登録する
+        from . import card_templates # カードのテンプレートを起動時に検証する
+        from . import hashers # ハッシュ方式の設定を起動時に検証する
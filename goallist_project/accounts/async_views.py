@@ -0,0 +1,101 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from .card_templates import CARD_TEMPLATES, DEFAULT_CARD_TEMPLATE, card_template_choices
+from .downloads import astream_field_file
+from .fragments import get_user_version, fragment_is_cached
+from .jobs import submit_card
+from .models import Users, Goals
+from .rendering import card_fields, card_name, get_card_storage
+from .views import GoalListView, GoalDetailView, PictGenerate, GoalPage, goal_page_queryset, goal_detail_queryset
+
+
+# ASGIで動かすときの夢一覧・夢の個別画面・画像のダウンロード・画像生成。
+# DBは非同期のORM（aget/afirst/async for）で読み、待っている間はイベントループが他のリクエストを処理する。
+# 通信の遅い端末が多くても、1プロセスで多くの接続を受けられる（同期のビューは1リクエストごとにスレッドを1つ占有する）。
+
+aget_user_version = sync_to_async(get_user_version)
+afragment_is_cached = sync_to_async(fragment_is_cached)
+
+
+def alogin_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        request.user = user # テンプレートからrequest.userを参照しても同期のDBアクセスが起きないようにする
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def arender(request, template_name, context):
+    """テンプレートはORMと同じスレッドで描画する。イベントループを描画で止めず、
+    描画中に同期のDBアクセスが起きても（DBの断片キャッシュ、描画直前に断片が消えた場合など）そのまま動く"""
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@alogin_required
+async def goal_list(request, pk):
+    user = request.user
+    cursor = request.GET.get('cursor', '')
+    version = await aget_user_version(user.pk)
+    if await afragment_is_cached('goal_list', user.pk, version, cursor):
+        rows = [] # 断片に描画済みなので読み込まない
+    else:
+        rows = [goal async for goal in goal_page_queryset(user, cursor, GoalListView.page_size)]
+    context = {
+        'page': GoalPage(rows, GoalListView.page_size),
+        'cursor': cursor,
+        'is_first_page': 'cursor' not in request.GET,
+        'fragment_version': version,
+    }
+    return await arender(request, GoalListView.template_name, context)
+
+
+@alogin_required
+async def goal_detail(request, pk):
+    queryset = goal_detail_queryset(request.user)
+    version = await aget_user_version(request.user.pk)
+    if await afragment_is_cached('goal_detail', request.user.pk, version, pk):
+        goal = SimpleLazyObject(lambda: queryset.filter(pk=pk).first()) # 断片が消えていたときだけ、描画するスレッドで読み込む
+    else:
+        goal = await queryset.filter(pk=pk).afirst() # prefetch_relatedも非同期で実行される
+        if goal is None:
+            raise Http404('夢が見つかりません')
+    context = {'goal': goal, 'goal_pk': pk, 'fragment_version': version, 'card_templates': card_template_choices()}
+    return await arender(request, GoalDetailView.template_name, context)
+
+
+async def download_profile_picture(request, pk):
+    user = await Users.objects.only('username', 'picture', 'upload_at').filter(pk=pk).afirst()
+    if user is None or not user.picture:
+        raise Http404('プロフィール画像がありません')
+    return await astream_field_file(request, user.picture, user.upload_at, f'{user.username}_profile_picture')
+
+
+@alogin_required
+async def pict_generate(request, pk):
+    profile_goal = await Goals.objects.select_related('user').filter(pk=pk, user=request.user).afirst()
+    if profile_goal is None:
+        raise Http404('夢が見つかりません')
+    template = request.GET.get('template', DEFAULT_CARD_TEMPLATE)
+    if template not in CARD_TEMPLATES:
+        raise Http404('テンプレートが見つかりません')
+    user_profile = profile_goal.user
+    fields = card_fields(user_profile, profile_goal)
+    card = card_name(fields, template)
+    if await sync_to_async(get_card_storage().exists, thread_sensitive=False)(card):
+        if user_profile.picture.name != card:
+            user_profile.picture.name = card
+            await user_profile.asave(update_fields=['picture', 'upload_at'])
+        context = {'image_url': user_profile.picture.url, 'picture': user_profile.picture}
+    else:
+        # 描画は数の決まったワーカー（settings.CARD_WORKERS）で行い、イベントループでは描かない
+        job_id = submit_card(user_profile.pk, fields, template)
+        context = {'status_url': reverse('accounts:pict_status', kwargs={'job_id': job_id})}
+    return await arender(request, PictGenerate.template_name, context)
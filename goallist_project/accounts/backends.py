@@ -0,0 +1,49 @@
+import copy
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+
+# ログイン中のユーザーの行をプロセス内に短時間だけ持ち、ページを開くたびのUsersの検索を省く。
+# 自分のプロセスで保存・ログアウトされたら即座に消し、他のプロセスでの変更はAUTH_USER_CACHE_TTL秒以内に反映される。
+_users = {}
+_lock = threading.Lock()
+
+
+def forget_user(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def clear_user_cache():
+    with _lock:
+        _users.clear()
+
+
+class CachedModelBackend(ModelBackend):
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            # 後ろのModelBackendは以前のセッションを読むためだけに残しているので、同じパスワードをもう一度ハッシュさせない
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        ttl = settings.AUTH_USER_CACHE_TTL
+        if not ttl:
+            return super().get_user(user_id)
+        now = time.monotonic()
+        with _lock:
+            cached = _users.get(user_id)
+        if cached is not None and cached[0] > now:
+            return copy.copy(cached[1]) # リクエストごとに別のインスタンスを渡す（属性の書き換えが他のリクエストに漏れない）
+        user = super().get_user(user_id)
+        if user is not None:
+            with _lock:
+                if len(_users) >= settings.AUTH_USER_CACHE_SIZE: # 上限を超えたら一度空にする（期限切れの掃除を兼ねる）
+                    _users.clear()
+                _users[user_id] = (now + ttl, copy.copy(user))
+        return user
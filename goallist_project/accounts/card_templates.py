@@ -0,0 +1,115 @@
+import os
+from django.conf import settings
+from django.core import checks
+
+
+# プロフィール画像（カード）のテンプレート。下地画像はSTATIC_DIRからの相対パス
+# fields: name=描く項目, point=左上の位置, size=フォントサイズ, max_width=折り返す幅(px), max_lines=最大行数
+# レイアウトを変えたらversionを上げる（そのテンプレートのカードだけが作り直される）
+DEFAULT_CARD_TEMPLATE = 'default'
+
+CARD_TEMPLATES = {
+    'default': {
+        'label': 'シンプル',
+        'version': 2,
+        'base_image': 'test.png',
+        'color': (255, 131, 25),
+        'fields': [ # 下地の画面は x=101〜475 なので、文字は x+max_width が470に収まるようにする
+            {'name': 'username', 'point': (130, 150), 'size': 40, 'max_width': 340, 'max_lines': 1},
+            {'name': 'job', 'point': (140, 220), 'size': 25},
+            {'name': 'birthday', 'point': (140, 260), 'size': 25},
+            {'name': 'introduction', 'point': (140, 300), 'size': 25, 'max_width': 330, 'max_lines': 1},
+            {'name': 'goal_title', 'point': (140, 340), 'size': 30, 'max_width': 330, 'max_lines': 1},
+            {'name': 'goal_detail', 'point': (140, 380), 'size': 30, 'max_width': 330, 'max_lines': 3},
+        ],
+    },
+    'sakura': {
+        'label': '桜',
+        'version': 1,
+        'base_image': 'sakura_right.png',
+        'background': (255, 246, 249),
+        'color': (199, 21, 133),
+        'fields': [
+            {'name': 'username', 'point': (330, 180), 'size': 64},
+            {'name': 'job', 'point': (340, 290), 'size': 36},
+            {'name': 'birthday', 'point': (340, 345), 'size': 36},
+            {'name': 'introduction', 'point': (340, 400), 'size': 36, 'max_width': 560, 'max_lines': 1},
+            {'name': 'goal_title', 'point': (340, 480), 'size': 48, 'max_width': 600, 'max_lines': 1},
+            {'name': 'goal_detail', 'point': (340, 560), 'size': 40, 'max_width': 560, 'max_lines': 3},
+        ],
+    },
+    'cosmos': {
+        'label': 'コスモス',
+        'version': 1,
+        'base_image': 'cosmos_left.png',
+        'background': (250, 248, 240),
+        'color': (110, 40, 130),
+        'fields': [
+            {'name': 'username', 'point': (460, 120), 'size': 64},
+            {'name': 'job', 'point': (470, 230), 'size': 36},
+            {'name': 'birthday', 'point': (470, 285), 'size': 36},
+            {'name': 'introduction', 'point': (470, 340), 'size': 36, 'max_width': 620, 'max_lines': 1},
+            {'name': 'goal_title', 'point': (470, 420), 'size': 48, 'max_width': 640, 'max_lines': 1},
+            {'name': 'goal_detail', 'point': (470, 500), 'size': 40, 'max_width': 620, 'max_lines': 3},
+        ],
+    },
+}
+
+CARD_FIELD_NAMES = ('username', 'job', 'birthday', 'introduction', 'goal_title', 'goal_detail')
+
+
+def card_template_choices(): # 画面に出す (名前, 表示名) の一覧
+    return [(name, layout['label']) for name, layout in CARD_TEMPLATES.items()]
+
+
+def _is_color(value):
+    return isinstance(value, tuple) and len(value) == 3 and all(isinstance(v, int) and 0 <= v <= 255 for v in value)
+
+
+def validate_layout(name, layout):
+    """レイアウトの誤りをメッセージのリストで返す（画像やフォントは読み込まず、ファイルがあるかだけ確かめる）"""
+    errors = []
+    for key in ('label', 'version', 'base_image', 'color', 'fields'):
+        if key not in layout:
+            errors.append(f'{name}: {key}がありません')
+    if errors:
+        return errors
+    if not os.path.isfile(os.path.join(settings.STATIC_DIR, layout['base_image'])):
+        errors.append(f'{name}: 下地画像 {layout["base_image"]} が見つかりません')
+    if 'font' in layout and not os.path.isfile(layout['font']):
+        errors.append(f'{name}: フォント {layout["font"]} が見つかりません')
+    for key in ('color', 'background'):
+        if key in layout and not _is_color(layout[key]):
+            errors.append(f'{name}: {key}は(R, G, B)で指定してください')
+    names = [field.get('name') for field in layout['fields']]
+    if sorted(names) != sorted(CARD_FIELD_NAMES):
+        errors.append(f'{name}: fieldsには{", ".join(CARD_FIELD_NAMES)}を1つずつ指定してください')
+    for field in layout['fields']:
+        point = field.get('point')
+        if not (isinstance(point, tuple) and len(point) == 2 and all(isinstance(v, int) for v in point)):
+            errors.append(f'{name}.{field.get("name")}: pointは(x, y)で指定してください')
+        if not isinstance(field.get('size'), int) or field['size'] <= 0:
+            errors.append(f'{name}.{field.get("name")}: sizeは正の整数で指定してください')
+        if 'max_width' in field and (not isinstance(field['max_width'], int) or field['max_width'] <= 0):
+            errors.append(f'{name}.{field.get("name")}: max_widthは正の整数で指定してください')
+        if 'max_lines' in field and (not isinstance(field['max_lines'], int) or field['max_lines'] <= 0):
+            errors.append(f'{name}.{field.get("name")}: max_linesは正の整数で指定してください')
+    return errors
+
+
+@checks.register()
+def check_card_templates(app_configs, **kwargs): # 起動時（manage.py check / runserver）にレイアウトを検証する
+    if DEFAULT_CARD_TEMPLATE not in CARD_TEMPLATES:
+        return [checks.Error(f'{DEFAULT_CARD_TEMPLATE}テンプレートがありません', id='accounts.E001')]
+    errors = [
+        checks.Error(message, id='accounts.E001')
+        for name, layout in CARD_TEMPLATES.items()
+        for message in validate_layout(name, layout)
+    ]
+    if not os.path.isfile(settings.CARD_FONT_PATH): # 最初のカードの描画で失敗する前に知らせる
+        errors.append(checks.Error(
+            f'CARD_FONT_PATHのフォント {settings.CARD_FONT_PATH} が見つかりません',
+            hint='環境変数CARD_FONT_PATHに日本語フォント（.ttf/.ttc/.otf）のパスを指定してください',
+            id='accounts.E002',
+        ))
+    return errors
@@ -0,0 +1,126 @@
+import hashlib
+import mimetypes
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+CHUNK_SIZE = 64 * 1024 # 一度に送るバイト数
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception): # 正しい形式だが、ファイルの中を指していない範囲（416で返す）
+    pass
+
+
+def parse_range(header, size):
+    """Rangeヘッダーの "bytes=start-end" を(start, end)に変換する。
+    扱えない指定（複数の範囲、bytes以外の単位、形式の誤り）はNoneを返し、ヘッダーを無視してファイル全体を返す（RFC 9110 14.2）。
+    ファイルの中を指していない範囲はRangeNotSatisfiableを送出する"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '': # "bytes=-500" は末尾500バイト
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end != '' and int(end) < start: # "bytes=5-2" は形式の誤り
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    return start, end
+
+
+def file_iterator(file, start, length): # ファイルの一部をチャンクごとに読み出す
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def afile_iterator(file, start, length): # ASGI用。読み込みだけをスレッドで行い、イベントループを止めない
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_etag(field_file, modified):
+    return quote_etag(hashlib.md5(f'{field_file.name}:{modified.isoformat()}'.encode()).hexdigest())
+
+
+def stream_field_file(request, field_file, modified, filename, asynchronous=False):
+    """FileFieldの中身をチャンク単位で返す。Range・ETag/Last-Modified・X-Sendfileに対応。
+    asynchronous=Trueなら非同期イテレータで返す（ASGIで同期イテレータを返すとファイル全体を読み込んでから送られる）"""
+    etag = file_etag(field_file, modified)
+    last_modified = int(modified.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+    mode = getattr(settings, 'PICTURE_SENDFILE', None)
+    if mode: # 実際の送信はフロントのプロキシ(Apache/nginx)に任せる
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.PICTURE_SENDFILE_PREFIX + field_file.name
+        else:
+            response['X-Sendfile'] = field_file.path
+    else:
+        size = field_file.storage.size(field_file.name)
+        byte_range = None
+        if 'HTTP_RANGE' in request.META:
+            if_range = request.META.get('HTTP_IF_RANGE')
+            if if_range is None or if_range == etag:
+                try:
+                    byte_range = parse_range(request.META['HTTP_RANGE'], size)
+                except RangeNotSatisfiable:
+                    response = HttpResponse(status=416)
+                    response['Content-Range'] = f'bytes */{size}'
+                    return response
+        file = field_file.storage.open(field_file.name, 'rb')
+        if byte_range is None and not asynchronous:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = byte_range or (0, size - 1)
+            iterator = afile_iterator if asynchronous else file_iterator
+            response = StreamingHttpResponse(iterator(file, start, end - start + 1), status=206 if byte_range else 200, content_type=content_type)
+            if byte_range:
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{content_type.split("/")[1]}"'
+    return response
+
+
+async def astream_field_file(request, field_file, modified, filename):
+    """ASGI用のstream_field_file。サイズの取得やファイルを開く処理はスレッドで行い、イベントループではチャンクを送るだけにする"""
+    return await sync_to_async(stream_field_file, thread_sensitive=False)(request, field_file, modified, filename, asynchronous=True)
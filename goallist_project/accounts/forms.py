@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.core import validators
 from datetime import datetime
+from django.utils import timezone
 from .models import Users, Goals, Tasks
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.forms import AuthenticationForm
@@ -23,10 +24,15 @@ class RegistForm(forms.ModelForm):
         confirm_password = cleaned_data['confirm_password']
         if password != confirm_password:
             raise forms.ValidationError('パスワードが異なります')
+        # パスワードの検証はここで1回だけ行う（ユーザー名・メールアドレスとの類似もみる）
+        try:
+            validate_password(password, Users(username=cleaned_data.get('username'), address=cleaned_data.get('address')))
+        except ValidationError as e:
+            self.add_error('password', e)
+        return cleaned_data
     
     def save(self, commit=False):
         user = super().save(commit=False)
-        validate_password(self.cleaned_data['password'], user)
         user.set_password(self.cleaned_data['password'])
         user.save()
         return user
@@ -73,11 +79,12 @@ class GoalRegistForm(forms.ModelForm):
         model = Goals
         fields = ['goal_title', 'goal_detail']
     
-    def save(self, *args, **kwargs):
+    def save(self, commit=True):
         obj = super(GoalRegistForm, self).save(commit=False)
         obj.created_at = datetime.now()
         obj.upload_at = datetime.now()
-        obj.save()
+        if commit: # commit=Falseで呼ばれたときは保存しない（保存は呼び出し側の1回だけにする）
+            obj.save()
         return obj
 
 
@@ -89,8 +96,27 @@ class GoalEditForm(forms.ModelForm):
         model = Goals
         fields = ['goal_title', 'goal_detail']
     
-    def save(self, *args, **kwargs):
+    def save(self, commit=True):
         obj = super(GoalEditForm, self).save(commit=False)
         obj.upload_at = datetime.now()
-        obj.save()
-        return obj
\ No newline at end of file
+        if commit:
+            obj.save()
+        return obj
+
+class TaskForm(forms.ModelForm): # タスクの一括操作APIで1件ずつの入力チェックに使う
+    task_title = forms.CharField(max_length=50, required=True)
+    task_priority = forms.IntegerField(required=False)
+    task_due = forms.DateField(required=False)
+    task_condition = forms.BooleanField(required=False)
+    
+    class Meta:
+        model = Tasks
+        fields = ['task_title', 'task_priority', 'task_due', 'task_condition']
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('task_priority') is None:
+            cleaned_data['task_priority'] = 0
+        if cleaned_data.get('task_due') is None:
+            cleaned_data['task_due'] = timezone.localdate()
+        return cleaned_data
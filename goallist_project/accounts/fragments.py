@@ -0,0 +1,52 @@
+import time
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from .oncommit import add_on_commit
+
+
+# 夢一覧・夢の個別画面の描画結果（テンプレートの{% cache %}断片）をユーザーごとのバージョン付きで保存する。
+# Goals/Tasks/Usersが変わったらバージョンを1つ上げるだけで、そのユーザーの古い断片はすべて使われなくなる。
+FRAGMENT_CACHE = 'fragments'
+
+
+def get_fragment_cache():
+    return caches[FRAGMENT_CACHE]
+
+
+def _version_key(user_id):
+    return f'fragment-version:{user_id}'
+
+
+def get_user_version(user_id):
+    cache = get_fragment_cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # 消えたあとに1から数え直すと古い断片と重なるので、時刻を初期値にする
+        cache.add(_version_key(user_id), time.time_ns(), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def bump_user_version(user_id):
+    cache = get_fragment_cache()
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError: # まだ無いときは新しい値を入れれば十分
+        cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def fragment_is_cached(fragment_name, *vary_on):
+    return get_fragment_cache().has_key(make_template_fragment_key(fragment_name, vary_on))
+
+
+def bump_goal_owners(goal_ids, using=None):
+    """タスクの変更時用。夢の持ち主はコミット時にまとめて1回のクエリで調べる（登録はトランザクションごとに1回）"""
+    add_on_commit(_bump_goal_owners, goal_ids, using=using)
+
+
+def _bump_goal_owners(goal_ids, using):
+    from .models import Goals
+    if not goal_ids:
+        return
+    for user_id in set(Goals.objects.using(using).filter(pk__in=goal_ids).values_list('user_id', flat=True)):
+        bump_user_version(user_id)
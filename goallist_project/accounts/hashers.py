@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, Argon2PasswordHasher
+from django.core import checks
+
+
+# ハッシュの強さをsettingsで調整できるようにしたもの。アルゴリズム名はDjangoのものと同じなので、既存のハッシュもそのまま照合できる。
+# 設定を変えると、次にログインに成功したときに新しい設定でハッシュし直される（Djangoのmust_update）。
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self): # KiB
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+@checks.register(checks.Tags.security)
+def check_password_hasher_profile(app_configs, **kwargs):
+    if settings.PASSWORD_HASHER_PROFILE == 'argon2':
+        try:
+            import argon2 # noqa: F401
+        except ImportError:
+            return [checks.Error('PASSWORD_HASHER_PROFILE=argon2 には argon2-cffi が必要です', id='accounts.E002')]
+    return []
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from django.db import connections
+from .models import Users
+from .rendering import card_digest, ensure_card, get_card_storage, CARD_DIR
+from .variants import generate_variants
+from .profiling import profile_job
+
+
+# プロフィール画像の生成はリクエストのスレッドではなく、プロセス内のワーカーで行う
+_executor = None
+_jobs = {} # job_id -> Future（同じ夢への重複リクエストは同じFutureにまとめる）
+_failed_at = {} # job_id -> 失敗した時刻（状態を読まれるか、FAILED_JOB_TTLを過ぎたら忘れる）
+FAILED_JOB_TTL = 600
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CARD_WORKERS, thread_name_prefix='card')
+        return _executor
+
+
+def make_job_id(user_id, fields, template):
+    return f'{user_id}-{card_digest(fields, template)}'
+
+
+def parse_job_id(job_id): # (user_id, カードのファイル名)。形式が違えばNone
+    user_id, _, digest = job_id.partition('-')
+    if not user_id.isdigit() or len(digest) != 64 or not digest.isalnum():
+        return None
+    return int(user_id), f'{CARD_DIR}/{digest}.png'
+
+
+def generate_card(user_id, fields, template):
+    try:
+        with profile_job('accounts:card_job'):
+            name = ensure_card(fields, template)
+            user = Users.objects.only('picture').get(pk=user_id)
+            user.picture.name = name
+            user.save(update_fields=['picture', 'upload_at']) # post_saveでユーザーのキャッシュと画面の断片も無効になる
+        submit_variants(name) # 縮小版は別のジョブで作り、カードはここで完成として返す
+        return name
+    finally:
+        connections.close_all() # ワーカースレッドのDB接続を残さない
+
+
+def generate_card_variants(name):
+    with profile_job('accounts:variant_job'):
+        generate_variants(name)
+
+
+def submit_variants(name): # 一覧などで使う縮小版を先に作っておく（間に合わなければpicture_variantがその場で作る）
+    job_id = f'variants:{name}'
+    executor = get_executor()
+    with _lock:
+        if job_id in _jobs and not _jobs[job_id].done():
+            return
+        future = executor.submit(generate_card_variants, name)
+        _jobs[job_id] = future
+    future.add_done_callback(lambda f: _forget(job_id, f))
+
+
+def submit_card(user_id, fields, template):
+    job_id = make_job_id(user_id, fields, template)
+    executor = get_executor()
+    with _lock:
+        future = _jobs.get(job_id)
+        submitted = future is None or (future.done() and future.exception() is not None) # 未登録か、前回失敗していれば投入する
+        if submitted:
+            future = executor.submit(generate_card, user_id, fields, template)
+            _jobs[job_id] = future
+    if submitted: # 終わっていればこのスレッドで_forgetが呼ばれるので、_lockの外で登録する
+        future.add_done_callback(lambda f: _forget(job_id, f))
+    return job_id
+
+
+def _forget(job_id, future):
+    with _lock:
+        if future.exception() is None: # 成功したジョブはストレージを見れば分かるので忘れる
+            if _jobs.get(job_id) is future:
+                del _jobs[job_id]
+        else:
+            _failed_at[job_id] = time.monotonic()
+        expired = [key for key, failed_at in _failed_at.items() if time.monotonic() - failed_at > FAILED_JOB_TTL]
+        for key in expired: # 誰も状態を読みに来なかった失敗は、ここでまとめて忘れる
+            _discard_failed(key)
+
+
+def _discard_failed(job_id): # _lockを持って呼ぶ
+    _failed_at.pop(job_id, None)
+    future = _jobs.get(job_id)
+    if future is not None and future.done() and future.exception() is not None:
+        del _jobs[job_id]
+
+
+def wait_for_jobs(timeout=None): # 投入済みのジョブ（カードから続く縮小版のジョブも）が終わるまで待つ（管理コマンド用）
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _lock:
+            pending = [future for future in _jobs.values() if not future.done()]
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if not pending or (remaining is not None and remaining <= 0):
+            return
+        wait(pending, timeout=remaining)
+
+
+def job_status(job_id):
+    """ジョブの状態を {'status': 'pending' | 'done' | 'failed', 'image_url': ...} で返す"""
+    parsed = parse_job_id(job_id)
+    if parsed is None:
+        return None
+    name = parsed[1]
+    future = _jobs.get(job_id)
+    if future is not None and not future.done():
+        return {'status': 'pending'}
+    if future is not None and future.exception() is not None:
+        with _lock: # 失敗は一度伝えれば十分なので、例外とトレースバックを持ち続けない
+            _discard_failed(job_id)
+        return {'status': 'failed'}
+    storage = get_card_storage()
+    if storage.exists(name):
+        return {'status': 'done', 'image_url': storage.url(name)}
+    return {'status': 'pending'} # 別のワーカープロセスで生成中の可能性がある
@@ -0,0 +1,250 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from accounts.backends import clear_user_cache
+from accounts.fragments import FRAGMENT_CACHE
+from accounts.jobs import wait_for_jobs
+from accounts.models import Users, Goals, Tasks
+from accounts.rendering import card_fields, ensure_card
+from .profile_report import percentile
+
+
+PASSWORD = 'bench-Pa55word!'
+
+# 1リクエストあたりのSQLの上限。--checkでこれを超えたら失敗にする（N+1の検出用）。manage.py test（accounts.tests）でも確かめる
+QUERY_BUDGETS = {
+    'login': 10,
+    'goal_list': 4,
+    'goal_detail': 4,
+    'goal_create': 12,
+    'goal_edit': 12, # 夢の保存のトランザクションと、コミット後の検索用の文書の作り直し（SELECT 2件とUPSERT）を含む
+    'goal_delete': 12,
+    'card_generate': 5,
+    'picture_download': 2,
+}
+# GETで書き込みをしてはいけない画面
+READ_ONLY = {'goal_list', 'goal_detail', 'picture_download'}
+
+WRITE_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+@contextmanager
+def bench_database(**overrides):
+    """使い捨てのテスト用DBとMEDIA_ROOTを用意する（本番のDBやキャッシュの中身には触れない）"""
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as tmp:
+        if connection.vendor == 'sqlite': # メモリ上ではなくファイルのDBで測る（WALなどの設定も効かせる）
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=os.path.join(tmp, 'media'), **overrides):
+                caches[FRAGMENT_CACHE].clear()
+                clear_user_cache()
+                yield
+                wait_for_jobs()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def seed_data(n_users, n_goals, n_tasks):
+    """n_users人にn_goals件（上限100）ずつの夢とn_tasks件ずつのタスクを入れる。
+    (ユーザーの一覧, 作成・削除用の夢の無いユーザー)を返す。先頭のユーザーにはプロフィール画像も作る"""
+    password = make_password(PASSWORD) # ハッシュ計算は1回だけ
+    Users.objects.bulk_create([
+        Users(username=f'bench{i}', address=f'bench{i}@example.com', password=password, job='計測', introduction='ベンチマーク')
+        for i in range(n_users)
+    ])
+    users = list(Users.objects.order_by('pk'))
+    for user in users:
+        Goals.objects.bulk_create([
+            Goals(user=user, goal_title=f'夢{i}', goal_detail=f'詳細{i}') for i in range(min(n_goals, 100))
+        ])
+        Tasks.objects.bulk_create([
+            Tasks(goals=goal, task_title=f'タスク{j}', task_priority=j, task_condition=j % 3 == 0)
+            for goal in Goals.objects.filter(user=user) for j in range(n_tasks)
+        ], batch_size=1000)
+    spare = Users.objects.create(username='spare', address='spare@example.com', password=password)
+    for user in users[:1]:
+        goal = Goals.objects.filter(user=user).first()
+        user.picture.name = ensure_card(card_fields(user, goal))
+        user.save(update_fields=['picture'])
+    return users, spare
+
+
+def summarize(samples):
+    return {
+        'requests': len(samples),
+        'rps': len(samples) / sum(samples) if sum(samples) else 0,
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = 'accountsアプリの主要画面の処理量・応答時間・SQL数を、テスト用DBに投入したデータで計測する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help='投入するユーザー数')
+        parser.add_argument('--goals', type=int, default=100, help='ユーザーごとの夢の数（上限100）')
+        parser.add_argument('--tasks', type=int, default=10, help='夢ごとのタスク数')
+        parser.add_argument('--requests', type=int, default=50, help='画面ごとのリクエスト数')
+        parser.add_argument('--logins', type=int, default=5, help='ログインの回数（パスワードのハッシュ計算が重いので少なめ）')
+        parser.add_argument('--output', help='結果を書き出すJSONファイル')
+        parser.add_argument('--compare', help='比較する以前の結果(JSON)')
+        parser.add_argument('--postgresql', action='store_true', help='DB_ENGINE=postgresqlでも計測する（接続できなければ省略）')
+        parser.add_argument('--session', choices=sorted(settings.SESSION_ENGINES), help='使うセッションの保存先（省略時はSESSION_BACKEND）')
+        parser.add_argument('--no-user-cache', action='store_true', help='ログイン中のユーザーのキャッシュを無効にする（AUTH_USER_CACHE_TTL=0）')
+        parser.add_argument('--check', action='store_true', help='SQL数の上限超過やGETでの書き込みがあれば失敗にする')
+
+    def handle(self, *args, **options):
+        # 既存の画面はdatetime.now()で日時を入れているので、その警告で結果が埋もれないようにする
+        warnings.filterwarnings('ignore', r'DateTimeField .* received a naive datetime', RuntimeWarning)
+        runs = {connection.vendor: self.run_on_test_database(options)}
+        if options['postgresql'] and connection.vendor != 'postgresql':
+            runs.update(self.run_postgresql(options))
+        keys = ('users', 'goals', 'tasks', 'requests', 'session', 'no_user_cache')
+        result = {'time': time.time(), 'options': {k: options[k] for k in keys}, 'runs': runs}
+
+        for vendor, run in runs.items():
+            self.print_run(vendor, run)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                self.print_comparison(json.load(f), result)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+        violations = [v for run in runs.values() for v in run.get('violations', [])]
+        if options['check'] and violations:
+            raise CommandError('\n'.join(violations))
+
+    def run_postgresql(self, options):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'postgresql.json')
+            args = [sys.executable, sys.argv[0], 'bench_accounts', '--output', output]
+            for key in ('users', 'goals', 'tasks', 'requests', 'logins'):
+                args += [f'--{key}', str(options[key])]
+            if options['session']:
+                args += ['--session', options['session']]
+            if options['no_user_cache']:
+                args.append('--no-user-cache')
+            proc = subprocess.run(args, env=dict(os.environ, DB_ENGINE='postgresql'), capture_output=True, text=True)
+            if proc.returncode != 0 or not os.path.exists(output):
+                self.stdout.write(self.style.WARNING('PostgreSQLに接続できないため省略しました'))
+                return {}
+            with open(output, encoding='utf-8') as f:
+                return json.load(f)['runs']
+
+    def run_on_test_database(self, options):
+        overrides = {}
+        if options['session']:
+            overrides['SESSION_ENGINE'] = settings.SESSION_ENGINES[options['session']]
+        if options['no_user_cache']:
+            overrides['AUTH_USER_CACHE_TTL'] = 0
+        with bench_database(**overrides):
+            return self.run_scenarios(options)
+
+    def measure(self, name, n, request, results):
+        samples = []
+        first_queries = None
+        for i in range(n):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request(i)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                samples.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise CommandError(f'{name}: ステータス {response.status_code}')
+            if first_queries is None: # キャッシュが効く前の1回目でSQLを数える
+                first_queries = [q['sql'] for q in queries.captured_queries]
+        row = summarize(samples)
+        row['queries'] = len(first_queries)
+        row['writes'] = sum(1 for sql in first_queries if WRITE_RE.match(sql))
+        results[name] = row
+
+    def run_scenarios(self, options):
+        start = time.perf_counter()
+        users, spare = seed_data(options['users'], options['goals'], options['tasks'])
+        seed_seconds = time.perf_counter() - start
+        user = users[0]
+        n = options['requests']
+        goal_ids = list(Goals.objects.filter(user=user).values_list('pk', flat=True))
+        results = {}
+
+        anonymous = Client()
+        self.measure('login', options['logins'], lambda i: anonymous.post(
+            reverse('accounts:user_login'), {'username': user.address, 'password': PASSWORD},
+        ), results)
+
+        client = Client()
+        client.force_login(user)
+        self.measure('goal_list', n, lambda i: client.get(reverse('accounts:goal_list', kwargs={'pk': user.pk})), results)
+        self.measure('goal_detail', n, lambda i: client.get(
+            reverse('accounts:goal_detail', kwargs={'pk': goal_ids[i % len(goal_ids)]}),
+        ), results)
+        self.measure('goal_edit', n, lambda i: client.post(
+            reverse('accounts:goal_edit', kwargs={'pk': goal_ids[i % len(goal_ids)]}), {'goal_title': f'編集{i}', 'goal_detail': '計測'},
+        ), results)
+        self.measure('card_generate', n, lambda i: client.get(
+            reverse('accounts:pict_generate', kwargs={'pk': goal_ids[i % 5]}),
+        ), results)
+        self.measure('picture_download', n, lambda i: client.get(
+            reverse('accounts:download_profile_picture', kwargs={'pk': user.pk}),
+        ), results)
+
+        spare_client = Client()
+        spare_client.force_login(spare)
+        self.measure('goal_create', min(n, 100), lambda i: spare_client.post(
+            reverse('accounts:goal_regist'), {'goal_title': f'新しい夢{i}', 'goal_detail': '計測'},
+        ), results)
+        spare_goals = list(Goals.objects.filter(user=spare).values_list('pk', flat=True))
+        self.measure('goal_delete', len(spare_goals), lambda i: spare_client.post(
+            reverse('accounts:goal_delete', kwargs={'pk': spare_goals[i]}),
+        ), results)
+
+        violations = []
+        for name, row in results.items():
+            if row['queries'] > QUERY_BUDGETS[name]:
+                violations.append(f'[{connection.vendor}] {name}: SQLが{row["queries"]}件（上限{QUERY_BUDGETS[name]}件）')
+            if name in READ_ONLY and row['writes']:
+                violations.append(f'[{connection.vendor}] {name}: GETで{row["writes"]}件の書き込みがあります')
+        return {'seed_seconds': seed_seconds, 'scenarios': results, 'violations': violations}
+
+    def print_run(self, vendor, run):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{vendor} (データ投入 {run["seed_seconds"]:.1f}秒)'))
+        self.stdout.write(f'{"画面":<18}{"件数":>6}{"req/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL":>5}{"書込":>5}')
+        for name, row in run['scenarios'].items():
+            self.stdout.write(
+                f'{name:<18}{row["requests"]:>6}{row["rps"]:>9.1f}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                f'{row["p99_ms"]:>9.2f}{row["queries"]:>5}{row["writes"]:>5}'
+            )
+        for violation in run['violations']:
+            self.stdout.write(self.style.ERROR(violation))
+
+    def print_comparison(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING('以前の結果との比較 (p50)'))
+        for vendor, run in after['runs'].items():
+            old = before.get('runs', {}).get(vendor, {}).get('scenarios', {})
+            for name, row in run['scenarios'].items():
+                if name in old and old[name]['p50_ms']:
+                    change = (row['p50_ms'] - old[name]['p50_ms']) / old[name]['p50_ms'] * 100
+                    self.stdout.write(f'{vendor:<12}{name:<18}{old[name]["p50_ms"]:>9.2f} -> {row["p50_ms"]:>9.2f} ms ({change:+.1f}%)')
@@ -0,0 +1,253 @@
+import asyncio
+import http
+import json
+import socket
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import WSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+from accounts.models import Goals
+from .bench_accounts import bench_database, seed_data, summarize
+
+
+# 同じ遅い端末（ソケットを直接使うクライアント）から、実際のHTTPサーバー越しに同期(WSGI)と非同期(ASGI)のビューを叩く。
+# 端末は「リクエストを少しずつ送り、応答を少しずつ読む」。サーバー側のコードには待ち時間を入れないので、
+# 遅い端末にワーカーが占有されるかどうかはサーバーの作り（スレッドかイベントループか）だけで決まる。
+
+
+class ThreadCounter: # 計測中のスレッド数の最大値
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args): # 1リクエストごとのアクセスログは出さない
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """ワーカースレッドの数が決まった同期サーバー（gunicornのsync/gthreadワーカーに近い）。
+    受け付けた接続は、リクエストを読み終えて応答を送り終えるまで1つのワーカーを占有する"""
+    request_queue_size = 1024
+
+    def __init__(self, *args, workers, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_in_worker, request, client_address)
+
+    def process_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+async def serve_asgi(app, reader, writer):
+    """計測用の最小限のHTTP/1.1サーバー（1接続1リクエスト、GETのみ）"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    method, target, _ = request_line.split(' ', 2)
+    path, _, query = target.partition('?')
+    headers = [(name.strip().lower().encode('latin-1'), value.strip().encode('latin-1'))
+               for name, _, value in (line.partition(':') for line in header_lines if line)]
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method, 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+        'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+        'client': writer.get_extra_info('peername')[:2], 'server': writer.get_extra_info('sockname')[:2],
+    }
+    finished = asyncio.Event()
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait() # Djangoは応答中も切断を待ち受けるので、応答を送り終えるまで返さない
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            lines = [f'HTTP/1.1 {status} {http.HTTPStatus(status).phrase}'.encode('latin-1')]
+            lines += [name + b': ' + value for name, value in message.get('headers', [])]
+            writer.write(b'\r\n'.join(lines + [b'Connection: close', b'', b'']))
+        elif message['type'] == 'http.response.body':
+            writer.write(message.get('body', b''))
+            await writer.drain() # 端末が読むまで待つが、その間もイベントループは他の接続を処理する
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+        writer.close()
+        await writer.wait_closed()
+
+
+class Command(BaseCommand):
+    help = ('同じ遅い端末を同期(WSGI)サーバーと非同期(ASGI)サーバーにつなぎ、処理量・応答時間・スレッド数を比べる。'
+            '端末はリクエストを--latencyかけて送り、応答を--bandwidthの速さで読む（サーバー側には待ち時間を入れない）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='同時に接続する端末の数')
+        parser.add_argument('--requests', type=int, default=5, help='端末ごとのリクエスト数')
+        parser.add_argument('--latency', type=float, default=200, help='リクエストを送り終えるまでの時間(ミリ秒)')
+        parser.add_argument('--bandwidth', type=float, default=64, help='端末が応答を読む速さ(KB/秒)')
+        parser.add_argument('--workers', type=int, default=8, help='WSGIのワーカースレッド数（プロセス数×スレッド数）')
+        parser.add_argument('--goals', type=int, default=100, help='ユーザーごとの夢の数')
+        parser.add_argument('--tasks', type=int, default=10, help='夢ごとのタスク数')
+        parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+
+    def handle(self, *args, **options):
+        warnings.filterwarnings('ignore', r'DateTimeField .* received a naive datetime', RuntimeWarning)
+        with bench_database():
+            users, _ = seed_data(1, options['goals'], options['tasks'])
+            user = users[0]
+            goal_ids = list(Goals.objects.filter(user=user).values_list('pk', flat=True))
+            client = Client()
+            client.force_login(user)
+            cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+            results = {
+                'wsgi': self.run_wsgi(user, goal_ids, cookie, options),
+                'asgi': asyncio.run(self.run_asgi(user, goal_ids, cookie, options)),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(
+            f'端末 {options["clients"]}台 × {options["requests"]}リクエスト、送信 {options["latency"]:.0f}ms、'
+            f'受信 {options["bandwidth"]:.0f}KB/秒、WSGIのワーカー {options["workers"]}'
+        )
+        self.stdout.write(f'{"":<6}{"req/s":>9}{"p50":>9}{"p95":>9}{"完了p95":>10}{"経過(秒)":>10}{"スレッド":>8}{"失敗":>6}')
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:<6}{row["rps"]:>9.1f}{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["client_p95_ms"]:>10.1f}'
+                f'{row["elapsed"]:>10.2f}{row["peak_threads"]:>8}{row["errors"]:>6}'
+            )
+
+    def urls(self, prefix, user, goal_ids, i): # 一覧・個別画面・画像のダウンロードを順に開く
+        kind = i % 3
+        if kind == 0:
+            return reverse(f'accounts:{prefix}goal_list', kwargs={'pk': user.pk})
+        if kind == 1:
+            return reverse(f'accounts:{prefix}goal_detail', kwargs={'pk': goal_ids[i % len(goal_ids)]})
+        return reverse(f'accounts:{prefix}download_profile_picture', kwargs={'pk': user.pk})
+
+    def run_wsgi(self, user, goal_ids, cookie, options):
+        server = PooledWSGIServer(('127.0.0.1', 0), QuietRequestHandler, workers=options['workers'])
+        server.set_app(get_wsgi_application())
+        serving = threading.Thread(target=server.serve_forever, daemon=True)
+        with ThreadCounter() as counter:
+            serving.start()
+            try:
+                result = self.run_clients(server.server_address[1], '', user, goal_ids, cookie, options)
+            finally:
+                server.shutdown()
+                server.server_close()
+        return self.result(*result, counter.peak)
+
+    async def run_asgi(self, user, goal_ids, cookie, options):
+        app = get_asgi_application()
+        server = await asyncio.start_server(lambda r, w: serve_asgi(app, r, w), '127.0.0.1', 0, backlog=1024)
+        port = server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        outcome = {}
+
+        def clients(): # 端末はイベントループとは別のスレッドで動かす（WSGIと同じ条件にする）
+            try:
+                outcome['result'] = self.run_clients(port, 'async_', user, goal_ids, cookie, options)
+            finally:
+                loop.call_soon_threadsafe(done.set)
+
+        with ThreadCounter() as counter:
+            async with server:
+                thread = threading.Thread(target=clients)
+                thread.start()
+                await done.wait()
+                thread.join()
+        return self.result(*outcome['result'], counter.peak)
+
+    def run_clients(self, port, prefix, user, goal_ids, cookie, options):
+        """(応答時間のリスト, 端末ごとの完了時刻のリスト, 経過秒, 失敗数) を返す"""
+        latency = options['latency'] / 1000
+        bandwidth = options['bandwidth'] * 1024
+        samples, finished = [], []
+        errors = 0
+
+        async def fetch(url):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096) # 受信側の窓を小さくして、遅い回線のようにサーバーの送信を詰まらせる
+            sock.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+            reader, writer = await asyncio.open_connection(sock=sock)
+            try:
+                request = f'GET {url} HTTP/1.1\r\nHost: testserver\r\nCookie: {cookie}\r\nConnection: close\r\n\r\n'.encode()
+                writer.write(request[:len(request) // 2]) # 前半を送ってから、残りが届くまで待たせる
+                await writer.drain()
+                await asyncio.sleep(latency)
+                writer.write(request[len(request) // 2:])
+                await writer.drain()
+                status = await reader.readline()
+                while chunk := await reader.read(4096):
+                    await asyncio.sleep(len(chunk) / bandwidth)
+                return status.split(b' ')[1] == b'200'
+            finally:
+                writer.close()
+
+        async def client(n):
+            nonlocal errors
+            for i in range(options['requests']):
+                begin = time.perf_counter()
+                if not await fetch(self.urls(prefix, user, goal_ids, n + i)):
+                    errors += 1
+                samples.append(time.perf_counter() - begin)
+            finished.append(time.perf_counter() - start)
+
+        async def main():
+            await asyncio.gather(*(client(n) for n in range(options['clients'])))
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return samples, finished, time.perf_counter() - start, errors
+
+    def result(self, samples, finished, elapsed, errors, peak_threads):
+        row = summarize(samples)
+        row['rps'] = len(samples) / elapsed # 同時に処理するので、全体の経過時間で割る
+        row['client_p95_ms'] = summarize(finished)['p95_ms'] # 端末が全部のリクエストを終えるまでの時間（待ち時間を含む）
+        row['elapsed'] = elapsed
+        row['peak_threads'] = peak_threads
+        row['errors'] = errors
+        return row
@@ -0,0 +1,81 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from accounts.hashers import TunedPBKDF2PasswordHasher, TunedArgon2PasswordHasher
+
+
+PASSWORD = 'bench-Pa55word!'
+
+
+def parse_argon2(value): # "時間コスト:メモリ(KiB):並列数"
+    try:
+        time_cost, memory_cost, parallelism = (int(v) for v in value.split(':'))
+    except ValueError:
+        raise CommandError(f'--argon2 は 時間コスト:メモリ(KiB):並列数 の形で指定してください: {value}')
+    return time_cost, memory_cost, parallelism
+
+
+class Command(BaseCommand):
+    help = 'パスワードのハッシュ方式・設定ごとに1秒あたりのハッシュ回数を測る（PASSWORD_HASHER_PROFILEなどを決める材料）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pbkdf2', type=int, nargs='*', help='測るPBKDF2の反復回数（省略時は現在の設定とDjangoの既定値）')
+        parser.add_argument('--argon2', nargs='*', help='測るArgon2の設定 "時間コスト:メモリ(KiB):並列数"（省略時は現在の設定）')
+        parser.add_argument('--seconds', type=float, default=2.0, help='設定ごとに測る時間')
+        parser.add_argument('--threads', type=int, default=1, help='同時にハッシュするスレッド数（ログインが集中したときの想定）')
+        parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+
+    def handle(self, *args, **options):
+        pbkdf2 = options['pbkdf2'] or sorted({settings.PASSWORD_PBKDF2_ITERATIONS or PBKDF2PasswordHasher.iterations, PBKDF2PasswordHasher.iterations})
+        argon2 = [parse_argon2(v) for v in options['argon2']] if options['argon2'] is not None else [
+            (settings.PASSWORD_ARGON2_TIME_COST, settings.PASSWORD_ARGON2_MEMORY_COST, settings.PASSWORD_ARGON2_PARALLELISM),
+        ]
+
+        configs = [(f'pbkdf2 iterations={n}', TunedPBKDF2PasswordHasher, {'PASSWORD_PBKDF2_ITERATIONS': n}) for n in pbkdf2]
+        try:
+            import argon2 as _ # noqa: F401
+            configs += [
+                (f'argon2 t={t} m={m} p={p}', TunedArgon2PasswordHasher, {
+                    'PASSWORD_ARGON2_TIME_COST': t, 'PASSWORD_ARGON2_MEMORY_COST': m, 'PASSWORD_ARGON2_PARALLELISM': p,
+                }) for t, m, p in argon2
+            ]
+        except ImportError:
+            self.stderr.write('argon2-cffi が無いのでArgon2は省略します')
+
+        results = []
+        for label, hasher_class, overrides in configs:
+            with override_settings(**overrides):
+                results.append(dict(label=label, **self.measure(hasher_class(), options['seconds'], options['threads'])))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'{"設定":<36}{"回数":>7}{"hash/s":>10}{"1回(ms)":>10}')
+        for row in results:
+            self.stdout.write(f'{row["label"]:<36}{row["hashes"]:>7}{row["per_second"]:>10.1f}{row["ms_per_hash"]:>10.1f}')
+
+    def measure(self, hasher, seconds, threads):
+        hasher.encode(PASSWORD, hasher.salt()) # 初回の読み込みを計測に含めない
+
+        def worker(_):
+            count = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                hasher.encode(PASSWORD, hasher.salt())
+                count += 1
+            return count
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            hashes = sum(executor.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+        return {
+            'threads': threads,
+            'hashes': hashes,
+            'per_second': hashes / elapsed,
+            'ms_per_hash': elapsed * threads / hashes * 1000,
+        }
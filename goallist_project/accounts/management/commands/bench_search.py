@@ -0,0 +1,80 @@
+import json
+import random
+import time
+import warnings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from accounts.models import Users, Goals, Tasks
+from accounts.search import icontains_search, search_goals
+from .bench_accounts import bench_database, summarize
+
+
+WORDS = ['富士山', '英語', '資格', '旅行', 'マラソン', '料理', 'ピアノ', '転職', '貯金', '読書', '筋トレ', '海外', '留学', '起業',
+         'プログラミング', 'カメラ', '登山', 'ダイエット', '早起き', '家族', '沖縄', '北海道', 'ギター', '資産運用', '日記']
+QUERIES = ['富士山', '英語', 'マラソン', '資産運用', 'プログラミング 海外', '北海道 旅行', '存在しない言葉']
+
+
+def phrase(rng, n):
+    return ''.join(rng.choice(WORDS) for _ in range(n))
+
+
+class Command(BaseCommand):
+    help = '夢の検索を、バイグラムの全文検索の索引とicontains（索引なし）で比べる。テスト用DBに投入したデータで測る'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='投入するユーザー数')
+        parser.add_argument('--goals', type=int, default=100, help='ユーザーごとの夢の数（上限100）')
+        parser.add_argument('--tasks', type=int, default=20, help='夢ごとのタスク数')
+        parser.add_argument('--repeat', type=int, default=20, help='検索語ごとの繰り返し回数')
+        parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+
+    def handle(self, *args, **options):
+        warnings.filterwarnings('ignore', r'DateTimeField .* received a naive datetime', RuntimeWarning)
+        with bench_database():
+            self.seed(options)
+            user = Users.objects.order_by('pk').first()
+            results = {}
+            for query in QUERIES:
+                indexed = self.measure(lambda: list(search_goals(user, query).values_list('pk', flat=True)), options['repeat'])
+                naive = self.measure(lambda: list(
+                    icontains_search(Goals.objects.filter(user=user), query).distinct().values_list('pk', flat=True)
+                ), options['repeat'])
+                hits = indexed.pop('hits')
+                results[query] = {'hits': len(hits), 'same': hits == naive.pop('hits'), 'index': indexed, 'icontains': naive}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'{connection.vendor}: {options["users"]}人 × 夢{options["goals"]}件 × タスク{options["tasks"]}件')
+        self.stdout.write(f'{"検索語":<20}{"件数":>6}{"一致":>4}{"索引p50":>10}{"索引p95":>10}{"icontains p50":>15}{"icontains p95":>15}')
+        for query, row in results.items():
+            self.stdout.write(
+                f'{query:<20}{row["hits"]:>6}{"○" if row["same"] else "×":>4}{row["index"]["p50_ms"]:>10.2f}{row["index"]["p95_ms"]:>10.2f}'
+                f'{row["icontains"]["p50_ms"]:>15.2f}{row["icontains"]["p95_ms"]:>15.2f}'
+            )
+
+    def seed(self, options):
+        rng = random.Random(0) # 毎回同じデータで比べる
+        password = make_password('bench-Pa55word!')
+        Users.objects.bulk_create([
+            Users(username=f'bench{i}', address=f'bench{i}@example.com', password=password) for i in range(options['users'])
+        ])
+        for user in Users.objects.all():
+            goals = Goals.objects.bulk_create([
+                Goals(user=user, goal_title=phrase(rng, 2)[:15], goal_detail=phrase(rng, 4)[:30]) for _ in range(min(options['goals'], 100))
+            ])
+            Tasks.objects.bulk_create([
+                Tasks(goals=goal, task_title=phrase(rng, 3)) for goal in goals for _ in range(options['tasks'])
+            ], batch_size=1000)
+        # 検索用の文書はコミット時に作られる（bench_databaseの中は自動コミット）
+
+    def measure(self, run, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits = run()
+            samples.append(time.perf_counter() - start)
+        row = summarize(samples)
+        row['hits'] = sorted(hits)
+        return row
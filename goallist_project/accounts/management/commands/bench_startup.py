@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# 子プロセスで実行する計測用のコード。起動からURLconf読み込みまでの時間とメモリを出力する
+PROBE = '''
+import json, os, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import accounts.urls
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+try:
+    import psutil
+    rss = psutil.Process().memory_info().rss
+except ImportError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({'seconds': elapsed, 'rss': rss}))
+'''
+
+# (名前, URLconfのあとに追加で読み込むモジュール)
+SCENARIOS = [
+    ('lazy (現在)', []),
+    ('PILを読み込んだ場合', ['PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont']),
+    ('cv2+numpy+PILを読み込んだ場合 (以前)', ['cv2', 'numpy', 'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont']),
+]
+
+
+class Command(BaseCommand):
+    help = 'ワーカー起動時（URLconf読み込みまで）の時間とメモリを、画像ライブラリの読み込み方ごとに比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='シナリオごとの実行回数')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'goallist_project.settings'))
+        results = {}
+        for name, modules in SCENARIOS:
+            samples = []
+            for _ in range(options['runs']):
+                proc = subprocess.run(
+                    [sys.executable, '-c', PROBE, *modules],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                )
+                if proc.returncode != 0:
+                    self.stdout.write(self.style.WARNING(f'{name}: 実行できません ({proc.stderr.strip().splitlines()[-1]})'))
+                    break
+                samples.append(json.loads(proc.stdout))
+            if not samples:
+                continue
+            seconds = statistics.median(s['seconds'] for s in samples)
+            rss = statistics.median(s['rss'] for s in samples)
+            results[name] = {'seconds': seconds, 'rss': rss}
+            self.stdout.write(f'{name}: {seconds * 1000:.1f} ms, RSS {rss / 1024 / 1024:.1f} MiB')
+        self.stdout.write(json.dumps(results, ensure_ascii=False))
@@ -0,0 +1,109 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from accounts.models import Users, Goals
+from accounts.views import encode_cursor
+
+
+# 索引を使わずに表全体を読んでいる箇所（SQLite: "SCAN 表名" で USING INDEX が無いもの / PostgreSQL: Seq Scan）
+FULL_SCAN_RES = {
+    'sqlite': re.compile(r'\bSCAN (?!.*\bUSING (COVERING )?INDEX\b)(\w+)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'mysql': re.compile(r'"access_type": "ALL".*?"table_name": "(\w+)"|type: ALL'),
+}
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY)|Sort Key:')
+
+
+class Recorder: # 実行されたSQLをパラメータごと集める
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = '主要画面で実行されるSELECTをEXPLAINし、表全体の読み込み（索引を使っていない箇所）を報告する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='画面を開くユーザーのIDかメールアドレス（省略時は夢が最も多いユーザー）')
+        parser.add_argument('--verbose', action='store_true', help='すべての実行計画を表示する')
+        parser.add_argument('--check', action='store_true', help='表全体の読み込みがあれば失敗にする')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        goals = list(Goals.objects.filter(user=user).order_by('-created_at', '-id')[:21])
+        pages = [
+            ('home', reverse('accounts:home')),
+            ('goal_list', reverse('accounts:goal_list', kwargs={'pk': user.pk})),
+            ('user_edit', reverse('accounts:user_edit', kwargs={'pk': user.pk})),
+        ]
+        if len(goals) > 20:
+            pages.append(('goal_list (2ページ目)', reverse('accounts:goal_list', kwargs={'pk': user.pk}) + f'?cursor={encode_cursor(goals[19])}'))
+        if goals:
+            pages += [
+                ('goal_detail', reverse('accounts:goal_detail', kwargs={'pk': goals[0].pk})),
+                ('goal_edit', reverse('accounts:goal_edit', kwargs={'pk': goals[0].pk})),
+            ]
+        if user.picture:
+            pages.append(('download_profile_picture', reverse('accounts:download_profile_picture', kwargs={'pk': user.pk})))
+
+        scan_re = FULL_SCAN_RES.get(connection.vendor)
+        if scan_re is None:
+            raise CommandError(f'{connection.vendor} の実行計画には対応していません')
+        flagged = []
+        for name, url in pages:
+            queries = self.capture(user, url)
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name}  {url}  (SELECT {len(queries)}件)'))
+            for sql, params in queries:
+                plan = self.explain(sql, params)
+                scans = sorted({m.group(1) or '?' for m in scan_re.finditer(plan)} - {'django_session'})
+                if scans:
+                    flagged.append((name, scans))
+                    self.stdout.write(self.style.ERROR(f'  表全体の読み込み: {", ".join(scans)}'))
+                    self.stdout.write(f'    {sql[:300]}')
+                elif TEMP_SORT_RE.search(plan):
+                    self.stdout.write(self.style.WARNING(f'  索引を使わずに並べ替え: {sql[:300]}'))
+                if options['verbose'] or scans:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        if options['check'] and flagged:
+            raise CommandError(f'{len(flagged)}件のSELECTが表全体を読み込んでいます')
+
+    def get_user(self, value):
+        users = Users.objects.all()
+        if value:
+            user = users.filter(address=value).first() if '@' in value else users.filter(pk=value).first()
+        else:
+            user = users.order_by('-goal_count', 'pk').first()
+        if user is None:
+            raise CommandError('対象のユーザーがいません')
+        return user
+
+    def capture(self, user, url):
+        recorder = Recorder()
+        # 断片キャッシュが効くとSQLが実行されないので、この間はキャッシュを使わない
+        dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        with override_settings(CACHES={'default': dummy, 'fragments': dummy}, AUTH_USER_CACHE_TTL=0), transaction.atomic():
+            client = Client()
+            client.force_login(user)
+            with connection.execute_wrapper(recorder):
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True) # セッションの作成などは残さない
+        if response.status_code >= 400:
+            raise CommandError(f'{url}: ステータス {response.status_code}')
+        return recorder.queries
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+        if connection.vendor == 'sqlite': # (id, parent, notused, detail)
+            return '\n'.join(row[-1] for row in rows)
+        return '\n'.join(str(row[0]) for row in rows)
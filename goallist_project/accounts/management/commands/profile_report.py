@@ -0,0 +1,66 @@
+import json
+import math
+import time
+from collections import deque
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, p): # 最近傍順位法
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)) # 順位は ceil(p/100 * n)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'RequestProfilingMiddlewareのログを、URL名ごとにp50/p95/p99で集計する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.REQUEST_PROFILING_LOG, help='集計するログファイル')
+        parser.add_argument('--window', type=int, default=10000, help='末尾から何件を集計するか')
+        parser.add_argument('--minutes', type=float, help='直近何分の記録だけを集計するか')
+        parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['log'], encoding='utf-8') as f:
+                lines = deque(f, maxlen=options['window']) # ファイル全体を持たずに末尾だけ残す
+        except FileNotFoundError:
+            raise CommandError(f'{options["log"]} がありません。REQUEST_PROFILING=1 で起動してください')
+
+        since = time.time() - options['minutes'] * 60 if options['minutes'] else None
+        groups = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if since and record['time'] < since:
+                continue
+            groups.setdefault(record['url_name'] or record.get('path'), []).append(record)
+
+        report = {}
+        for url_name, records in sorted(groups.items(), key=lambda item: str(item[0])):
+            totals = [r['total_ms'] for r in records]
+            report[url_name] = {
+                'count': len(records),
+                'p50_ms': percentile(totals, 50),
+                'p95_ms': percentile(totals, 95),
+                'p99_ms': percentile(totals, 99),
+                'sql_count_avg': sum(r['sql_count'] for r in records) / len(records),
+                'sql_ms_avg': sum(r['sql_ms'] for r in records) / len(records),
+                'template_ms_avg': sum(r['template_ms'] for r in records) / len(records),
+                'image_ms_avg': sum(r['image_ms'] for r in records) / len(records),
+                'duplicate_queries_max': max(r['duplicate_queries'] for r in records),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'{"URL名":<32}{"件数":>6}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL数":>7}{"SQL":>9}{"描画":>9}{"画像":>9}{"重複":>5}')
+        for url_name, row in report.items():
+            self.stdout.write(
+                f'{str(url_name):<32}{row["count"]:>6}{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}'
+                f'{row["sql_count_avg"]:>7.1f}{row["sql_ms_avg"]:>9.1f}{row["template_ms_avg"]:>9.1f}'
+                f'{row["image_ms_avg"]:>9.1f}{row["duplicate_queries_max"]:>5}'
+            )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from accounts.models import Users, goal_count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Users.goal_countをGoalsの実際の件数から作り直す'
+
+    def handle(self, *args, **options):
+        updated = Users.objects.update(goal_count=goal_count_subquery())
+        self.stdout.write(self.style.SUCCESS(f'{updated}人分の夢の数を更新しました'))
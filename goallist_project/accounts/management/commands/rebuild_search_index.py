@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import Goals
+from accounts.search import refresh_documents, rebuild_fts
+
+
+class Command(BaseCommand):
+    help = '夢の検索用の文書と索引をすべて作り直す（区切り方を変えたときや、索引が壊れたとき）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500, help='一度に作り直す夢の数')
+
+    def handle(self, *args, **options):
+        ids = Goals.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        with transaction.atomic():
+            batch = []
+            for goal_id in ids.iterator(chunk_size=options['batch']):
+                batch.append(goal_id)
+                if len(batch) >= options['batch']:
+                    refresh_documents(batch)
+                    total += len(batch)
+                    batch = []
+            refresh_documents(batch)
+            total += len(batch)
+            rebuild_fts()
+        self.stdout.write(self.style.SUCCESS(f'{total}件の夢の検索用の文書を作り直しました'))
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from accounts.models import Goals
+from accounts.card_templates import CARD_TEMPLATES, DEFAULT_CARD_TEMPLATE
+from accounts.rendering import card_fields, card_name, get_card_storage, render_card
+
+
+class Command(BaseCommand):
+    help = '夢ごとのプロフィール画像（カード）を事前にまとめて生成する。入力が変わっていないカードは飛ばす'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='描画に使うプロセス数')
+        parser.add_argument('--batch', type=int, default=64, help='一度にプロセスプールへ渡すカードの数')
+        parser.add_argument('--chunk-size', type=int, default=500, help='DBから一度に読む夢の数')
+        parser.add_argument('--user', type=int, help='このユーザーIDの夢だけを対象にする')
+        parser.add_argument('--template', default=DEFAULT_CARD_TEMPLATE, choices=list(CARD_TEMPLATES), help='使うカードのテンプレート')
+        parser.add_argument('--force', action='store_true', help='保存済みのカードも描き直す')
+
+    def handle(self, *args, **options):
+        storage = get_card_storage()
+        template = options['template']
+        goals = Goals.objects.select_related('user').only(
+            'goal_title', 'goal_detail',
+            'user__username', 'user__job', 'user__birthday', 'user__introduction',
+        ).order_by('pk')
+        if options['user']:
+            goals = goals.filter(user=options['user'])
+
+        scanned = rendered = skipped = 0
+        pending = {} # カード名 -> 描画内容（同じ内容のカードは1回だけ描く）
+        start = time.perf_counter()
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for goal in goals.iterator(chunk_size=options['chunk_size']):
+                scanned += 1
+                fields = card_fields(goal.user, goal)
+                name = card_name(fields, template)
+                if name in pending or (not options['force'] and storage.exists(name)):
+                    skipped += 1
+                    continue
+                pending[name] = fields
+                if len(pending) >= options['batch']:
+                    rendered += self.render_batch(pool, workers, storage, template, pending)
+                    pending = {}
+            if pending:
+                rendered += self.render_batch(pool, workers, storage, template, pending)
+        elapsed = time.perf_counter() - start
+
+        rate = rendered / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{scanned}件の夢を確認し、{rendered}枚を生成、{skipped}件は生成済みのため省略しました '
+            f'({elapsed:.1f}秒, {rate:.1f}枚/秒)'
+        ))
+
+    def render_batch(self, pool, workers, storage, template, pending):
+        names = list(pending)
+        chunksize = max(1, len(names) // (workers * 4))
+        for name, png in zip(names, pool.map(render_card, [pending[n] for n in names], [template] * len(names), chunksize=chunksize)):
+            storage.save(name, ContentFile(png))
+        return len(names)
@@ -0,0 +1,99 @@
+import datetime
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+from accounts.models import Tasks
+
+
+# 期限が近い（または少し過ぎた）未完了のタスクを、ユーザーごとに1通のメールにまとめて知らせる。
+# 対象は tasks_remind_due_idx（未完了かつ未通知のタスクの task_due, id）を範囲検索して拾う。
+# 送る前に reminded_at を条件付きUPDATEで埋めるので、同時に2つ動いても同じタスクを2回知らせない。
+
+def due_task_owners(start, end, batch_size):
+    """期限が start〜end の通知対象を (task_due, id) のキーセットで batch_size 件ずつ読み、
+    ユーザーID → タスクIDのリストにまとめる（数十万件でもintだけを持つ）"""
+    owners = {}
+    base = Tasks.objects.filter(
+        task_condition=False, reminded_at__isnull=True, task_due__gte=start, task_due__lte=end, goals__user__is_active=True,
+    ).order_by('task_due', 'id')
+    after = None
+    while True:
+        qs = base
+        if after is not None: # 前のバッチの最後より後ろだけ
+            due, pk = after
+            qs = qs.filter(task_due__gte=due).exclude(task_due=due, id__lte=pk)
+        rows = list(qs.values_list('task_due', 'id', 'goals__user_id')[:batch_size])
+        for due, pk, user_id in rows:
+            owners.setdefault(user_id, []).append(pk)
+        if len(rows) < batch_size:
+            return owners
+        after = rows[-1][:2]
+
+
+def claim_tasks(task_ids, run_at): # まだ誰も通知していない、有効なユーザーのタスクだけに印を付ける（送らないタスクには付けない）
+    return Tasks.objects.filter(
+        id__in=task_ids, task_condition=False, reminded_at__isnull=True, goals__user__is_active=True,
+    ).update(reminded_at=run_at)
+
+
+def build_digests(task_ids, run_at, today):
+    """この実行で印を付けたタスクを読み、ユーザーごとのメールにする"""
+    tasks = (
+        Tasks.objects.filter(id__in=task_ids, reminded_at=run_at)
+        .select_related('goals__user')
+        .only('task_title', 'task_due', 'goals__goal_title', 'goals__user__username', 'goals__user__address')
+        .order_by('goals__user_id', 'task_due', 'task_priority', 'id')
+    )
+    grouped = {}
+    for task in tasks:
+        grouped.setdefault(task.goals.user, []).append(task)
+    messages = []
+    for user, user_tasks in grouped.items():
+        context = {'user': user, 'tasks': user_tasks, 'today': today}
+        body = render_to_string('emails/task_reminder.txt', context)
+        messages.append(EmailMessage(f'【GoalList】期限が近いタスクが{len(user_tasks)}件あります', body, settings.DEFAULT_FROM_EMAIL, [user.address]))
+    return messages
+
+
+class Command(BaseCommand):
+    help = '期限が近い未完了のタスクを、ユーザーごとに1通のメールにまとめて知らせる（cronで定期的に実行する）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TASK_REMINDER_DAYS, help='期限が何日後までのタスクを知らせるか')
+        parser.add_argument('--overdue-days', type=int, default=settings.TASK_REMINDER_OVERDUE_DAYS, help='期限を過ぎて何日までのタスクを知らせるか')
+        parser.add_argument('--batch', type=int, default=5000, help='1回のクエリで読むタスクの件数')
+        parser.add_argument('--users-per-batch', type=int, default=200, help='1回にまとめて送るユーザー数')
+        parser.add_argument('--dry-run', action='store_true', help='送らずに件数だけ表示する（reminded_atも変えない）')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = today - datetime.timedelta(days=options['overdue_days'])
+        end = today + datetime.timedelta(days=options['days'])
+        owners = due_task_owners(start, end, options['batch'])
+        task_count = sum(len(ids) for ids in owners.values())
+        if options['dry_run']:
+            self.stdout.write(f'{start}〜{end}: {len(owners)}人 / {task_count}件（dry-run）')
+            return
+
+        run_at = timezone.now()
+        user_ids = sorted(owners)
+        step = options['users_per_batch']
+        sent = reminded = 0
+        connection = get_connection() # SMTPなら接続を1本だけ開いて使い回す
+        with connection:
+            for i in range(0, len(user_ids), step):
+                task_ids = [pk for user_id in user_ids[i:i + step] for pk in owners[user_id]]
+                claimed = claim_tasks(task_ids, run_at)
+                if not claimed: # ほかの実行がすでに知らせた
+                    continue
+                messages = build_digests(task_ids, run_at, today)
+                try:
+                    sent += connection.send_messages(messages) or 0
+                except Exception:
+                    # 送れなかった分は次の実行でまた拾えるように印を外す
+                    Tasks.objects.filter(id__in=task_ids, reminded_at=run_at).update(reminded_at=None)
+                    raise
+                reminded += claimed
+        self.stdout.write(f'{start}〜{end}: {sent}通 / {reminded}件を知らせました')
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_goal_count(apps, schema_editor):
+    Users = apps.get_model('accounts', 'Users')
+    Goals = apps.get_model('accounts', 'Goals')
+    counts = Goals.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(n=Count('pk')).values('n')
+    Users.objects.update(goal_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_goals_created_at_alter_goals_goal_detail_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='goal_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_goal_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_users_goal_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goals',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='goals_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tasks',
+            index=models.Index(fields=['goals', 'task_condition', 'task_due'], name='tasks_goal_cond_due_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_goals_tasks_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tasks',
+            index=models.Index(fields=['goals', 'task_priority', 'task_due', 'id'], name='tasks_goal_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tasks',
+            index=models.Index(condition=models.Q(('task_condition', False)), fields=['task_due', 'id'], name='tasks_open_due_idx'),
+        ),
+    ]
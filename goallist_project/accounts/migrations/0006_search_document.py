@@ -0,0 +1,98 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:30
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# このマイグレーションを作った時点の accounts.search の内容を写しておく（あとでアプリ側を変えても、ここは変わらない）
+FTS_TABLE = 'goal_search'
+WORD_RE = re.compile(r'\w+')
+
+
+def bigrams(text):
+    tokens = []
+    for word in WORD_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def document_body(goal, task_titles):
+    parts = [goal.goal_title, goal.goal_detail, *task_titles]
+    return ' '.join([f'user{goal.user_id}'] + [' '.join(bigrams(part)) for part in parts if part])
+
+
+SQLITE_FTS = [
+    # 外部コンテンツのFTS5（本文は goal_search_doc にだけ持つ）。区切りはバイグラムを作るときに済ませてある
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body, content='goal_search_doc', content_rowid='goal_id', tokenize='unicode61 remove_diacritics 0')""",
+    f"""CREATE TRIGGER goal_search_ai AFTER INSERT ON goal_search_doc BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (new.goal_id, new.body);
+    END""",
+    f"""CREATE TRIGGER goal_search_ad AFTER DELETE ON goal_search_doc BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', old.goal_id, old.body);
+    END""",
+    f"""CREATE TRIGGER goal_search_au AFTER UPDATE ON goal_search_doc BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', old.goal_id, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (new.goal_id, new.body);
+    END""",
+]
+SQLITE_FTS_DROP = [
+    'DROP TRIGGER IF EXISTS goal_search_ai', 'DROP TRIGGER IF EXISTS goal_search_ad', 'DROP TRIGGER IF EXISTS goal_search_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+POSTGRESQL_GIN = ["CREATE INDEX goal_search_body_gin ON goal_search_doc USING GIN (to_tsvector('simple'::regconfig, body))"]
+POSTGRESQL_GIN_DROP = ['DROP INDEX IF EXISTS goal_search_body_gin']
+
+
+def run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    run(schema_editor, {'sqlite': SQLITE_FTS, 'postgresql': POSTGRESQL_GIN})
+
+
+def drop_search_index(apps, schema_editor):
+    run(schema_editor, {'sqlite': SQLITE_FTS_DROP, 'postgresql': POSTGRESQL_GIN_DROP})
+
+
+def fill_search_documents(apps, schema_editor):
+    Goals = apps.get_model('accounts', 'Goals')
+    SearchDocument = apps.get_model('accounts', 'SearchDocument')
+    batch = []
+    for goal in Goals.objects.prefetch_related('tasks_set').iterator(chunk_size=500):
+        batch.append(SearchDocument(goal_id=goal.pk, user_id=goal.user_id, body=document_body(goal, [t.task_title for t in goal.tasks_set.all()])))
+        if len(batch) >= 500:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_tasks_priority_open_due_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('goal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='accounts.goals')),
+                ('body', models.TextField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'goal_search_doc',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
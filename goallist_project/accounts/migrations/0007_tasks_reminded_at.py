@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasks',
+            name='reminded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tasks',
+            index=models.Index(condition=models.Q(('reminded_at__isnull', True), ('task_condition', False)), fields=['task_due', 'id'], name='tasks_remind_due_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:48
+
+import re
+import unicodedata
+
+from django.db import migrations
+from django.db.models import Prefetch
+
+
+# 検索用の文書の項目の間に区切りの語を入れて作り直す（このマイグレーションを作った時点の accounts.search の写し）
+WORD_RE = re.compile(r'\w+')
+FIELD_SEPARATOR = 'sep'
+
+
+def bigrams(text):
+    tokens = []
+    for word in WORD_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def document_body(goal, task_titles):
+    parts = [goal.goal_title, goal.goal_detail, *task_titles]
+    return f' {FIELD_SEPARATOR} '.join([f'user{goal.user_id}'] + [' '.join(bigrams(part)) for part in parts if part])
+
+
+def rebuild_search_documents(apps, schema_editor):
+    Goals = apps.get_model('accounts', 'Goals')
+    SearchDocument = apps.get_model('accounts', 'SearchDocument')
+    Tasks = apps.get_model('accounts', 'Tasks')
+    goals = Goals.objects.prefetch_related(Prefetch('tasks_set', queryset=Tasks.objects.order_by('id')))
+    batch = []
+    for goal in goals.iterator(chunk_size=500):
+        batch.append(SearchDocument(goal_id=goal.pk, user_id=goal.user_id, body=document_body(goal, [t.task_title for t in goal.tasks_set.all()])))
+        if len(batch) >= 500:
+            SearchDocument.objects.bulk_update(batch, ['body']) # UPDATEのトリガーでFTS5の索引も更新される
+            batch = []
+    SearchDocument.objects.bulk_update(batch, ['body'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_tasks_reminded_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_search_documents, migrations.RunPython.noop),
+    ]
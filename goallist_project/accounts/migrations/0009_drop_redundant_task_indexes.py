@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_search_field_separator'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tasks',
+            name='tasks_open_due_idx',
+        ),
+        migrations.AlterField(
+            model_name='tasks',
+            name='goals',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='accounts.goals'),
+        ),
+    ]
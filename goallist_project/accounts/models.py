@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import (BaseUserManager, AbstractBaseUser, PermissionsMixin)
 from django.urls import reverse_lazy
 from datetime import datetime
@@ -52,6 +54,7 @@ class Users(AbstractBaseUser, PermissionsMixin):
     upload_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True) #ログインしているか
     is_staff = models.BooleanField(default=False) #管理権限
+    goal_count = models.IntegerField(default=0) #登録している夢の数（Goalsの作成・削除時に更新）
     
     USERNAME_FIELD = 'address' #ログイン時にメルアドが必要
     REQUIRED_FIELDS = ['username'] #superuser作成時に必要なフィールド
@@ -70,6 +73,57 @@ class BaseMeta(models.Model):
         abstract = True
 
 
+MAX_GOALS = 100  # 夢リストの上限数
+
+
+def reserve_goals(user_id, n=1):
+    """Users.goal_countを上限を超えない場合だけn増やす。条件付きUPDATE1回なので同時に登録されても上限を超えない"""
+    reserved = Users.objects.filter(pk=user_id, goal_count__lte=MAX_GOALS - n).update(goal_count=F('goal_count') + n)
+    if not reserved:
+        raise ValidationError("夢リストの上限に達しました。")
+
+
+def bump_users(user_ids):
+    from .fragments import bump_user_version
+    for user_id in user_ids:
+        bump_user_version(user_id)
+
+
+def goal_count_subquery():
+    """ユーザーごとの実際の夢の数。Users.goal_countの作り直しに使う"""
+    counts = Goals.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def task_summary_annotations():
+    """夢一覧のタスクの集計（全件数・完了数・未完了の最も近い期限）。
+    JOINしてGROUP BYすると全部の夢を集計してから並べ替えるので、ページの行だけを索引で数える相関サブクエリにする"""
+    tasks = Tasks.objects.filter(goals=OuterRef('pk')).order_by()
+    aggregate = lambda qs, value: Subquery(qs.values('goals').annotate(value=value).values('value'))
+    return {
+        'task_total': Coalesce(aggregate(tasks, Count('pk')), Value(0)),
+        'task_done': Coalesce(aggregate(tasks.filter(task_condition=True), Count('pk')), Value(0)),
+        'next_due': aggregate(tasks.filter(task_condition=False), Min('task_due')),
+    }
+
+
+class GoalsQuerySet(models.QuerySet):
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        per_user = {}
+        for obj in objs:
+            per_user[obj.user_id] = per_user.get(obj.user_id, 0) + 1
+        with transaction.atomic(using=self.db):
+            for user_id, n in per_user.items():
+                reserve_goals(user_id, n)
+            created = super().bulk_create(objs, *args, **kwargs)
+            transaction.on_commit(lambda: bump_users(per_user), using=self.db) # bulk_createはシグナルを送らない
+            from .search import schedule_refresh
+            schedule_refresh((goal.pk for goal in created), using=self.db)
+        return created
+
+
 class Goals(BaseMeta):
     user = models.ForeignKey(Users, on_delete=models.CASCADE)
     
@@ -77,18 +131,23 @@ class Goals(BaseMeta):
     goal_detail = models.CharField(max_length=30)
     goal_condition = models.IntegerField(blank=True, default=0)
     
+    objects = GoalsQuerySet.as_manager()
+    
     class Meta:
         db_table = 'goals'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='goals_user_created_idx'), #一覧のキーセットページング用
+        ]
     
     def get_absolute_url(self):
         return reverse_lazy('accounts:goal_detail', kwargs={'pk': self.pk})
     
     def save(self, *args, **kwargs):
-        user_goals = Goals.objects.filter(user=self.pk)
-        max_goals = 100  # 上限数
-        if self.pk is None and user_goals.count() >= max_goals:
-            raise ValidationError("夢リストの上限に達しました。")
-        super().save(*args, **kwargs)
+        if not self._state.adding: # 更新時は件数が変わらないのでチェックしない（idを指定した新しい夢は作成として数える）
+            return super().save(*args, **kwargs)
+        with transaction.atomic(savepoint=False): # 失敗したら外側のトランザクションごと戻すので、セーブポイントは作らない
+            reserve_goals(self.user_id)
+            super().save(*args, **kwargs)
         
     
     def __str__(self):
@@ -96,17 +155,67 @@ class Goals(BaseMeta):
     
 
 
+class TasksQuerySet(models.QuerySet):
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        from .fragments import bump_goal_owners
+        from .search import schedule_refresh
+        created = super().bulk_create(objs, *args, **kwargs)
+        goal_ids = {task.goals_id for task in created}
+        bump_goal_owners(goal_ids, using=self.db) # bulk_createはシグナルを送らないので、画面の断片と検索用の文書はここで更新する
+        schedule_refresh(goal_ids, using=self.db)
+        return created
+
+
 class Tasks(BaseMeta):
-    goals = models.ForeignKey(Goals, on_delete=models.CASCADE)
+    goals = models.ForeignKey(Goals, on_delete=models.CASCADE, db_index=False) # 夢ごとの検索は下の複合索引（先頭がgoals）で足りる
     
     task_title = models.CharField(max_length=50)
     task_condition = models.BooleanField(default='0', blank=False, null=False)
     task_priority = models.IntegerField(default='0', blank=False, null=False)
     task_due = models.DateField(default=timezone.now)
+    reminded_at = models.DateTimeField(null=True, blank=True) #期限のお知らせメールを送った日時（send_task_reminders）
+    
+    objects = TasksQuerySet.as_manager()
     
     class Meta:
         db_table = 'tasks'
-        
+        indexes = [
+            models.Index(fields=['goals', 'task_condition', 'task_due'], name='tasks_goal_cond_due_idx'), #夢ごとの進み具合の集計用
+            models.Index(fields=['goals', 'task_priority', 'task_due', 'id'], name='tasks_goal_priority_idx'), #夢の個別画面のタスクの並び順
+            models.Index(fields=['task_due', 'id'], condition=models.Q(task_condition=False, reminded_at__isnull=True), name='tasks_remind_due_idx'), #まだお知らせしていない未完了のタスク
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remind_state = instance.remind_state() # 読み込んだときの期限と完了状態（遅延読み込みの項目があればNone）
+        return instance
+    
+    def remind_state(self):
+        if {'task_due', 'task_condition'} & self.get_deferred_fields():
+            return None
+        return (self.task_due, self.task_condition)
+    
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_remind_state', None)
+        if self.reminded_at is not None and loaded is not None and loaded != self.remind_state():
+            self.reminded_at = None # 期限か完了状態が変わったら、もう一度お知らせの対象にする
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'reminded_at'}
+        super().save(*args, **kwargs)
+        self._remind_state = self.remind_state()
     
     def __str__(self):
-        return self.task_title
\ No newline at end of file
+        return self.task_title
+
+
+class SearchDocument(models.Model):
+    """夢1件ごとの検索用の文書（夢のタイトル・詳細とタスクのタイトルを2文字ずつに区切ったもの）。
+    SQLiteではFTS5、PostgreSQLではGINの索引をこの表に張る（accounts/search.py, マイグレーション0006）"""
+    goal = models.OneToOneField(Goals, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    user = models.ForeignKey(Users, on_delete=models.CASCADE)
+    body = models.TextField()
+    
+    class Meta:
+        db_table = 'goal_search_doc'
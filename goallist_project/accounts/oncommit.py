@@ -0,0 +1,43 @@
+import threading
+import weakref
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+# コミット時にまとめて1回だけ実行する処理（画面の断片の無効化、検索用の文書の作り直し）。
+# 同じトランザクションで何回呼ばれても on_commit に登録するのは1回だけで、集めた値をまとめて渡す。
+# 登録した_Batchはスレッドローカルから弱参照でだけ指す。ロールバック（セーブポイントへの巻き戻しを含む）で
+# Djangoが登録を捨てると集めた値も一緒に消えるので、次の別のトランザクションに古い値が混ざらない。
+
+_local = threading.local()
+
+
+class _Batch:
+    def __init__(self, func, using):
+        self.func = func
+        self.using = using
+        self.values = set()
+
+    def __call__(self):
+        batches = getattr(_local, 'batches', {})
+        key = (self.func, self.using)
+        if key in batches and batches[key]() is self:
+            del batches[key]
+        self.func(self.values, self.using)
+
+
+def add_on_commit(func, values, using=None):
+    """func(集めた値のset, using) をコミット時に1回だけ呼ぶ。トランザクションの外ではその場で呼ぶ"""
+    using = using or DEFAULT_DB_ALIAS
+    if not transaction.get_connection(using).in_atomic_block:
+        func(set(values), using)
+        return
+    batches = getattr(_local, 'batches', None)
+    if batches is None:
+        batches = _local.batches = {}
+    key = (func, using)
+    batch = batches[key]() if key in batches else None
+    if batch is None: # 未登録か、ロールバックで登録が捨てられた
+        batch = _Batch(func, using)
+        batches[key] = weakref.ref(batch)
+        transaction.on_commit(batch, using=using)
+    batch.values.update(values)
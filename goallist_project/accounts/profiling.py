@@ -0,0 +1,138 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+# リクエストごとの時間の内訳（合計・SQL・テンプレート描画・画像描画）を記録する。
+# settings.REQUEST_PROFILING = True のときだけ有効。結果は 'accounts.profiling' ロガーへJSONで1行ずつ出す。
+logger = logging.getLogger('accounts.profiling')
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+
+def add_time(name, seconds): # 計測中のリクエストがあれば、その内訳に時間を足す
+    profile = _current.get()
+    if profile is not None:
+        profile['spans'][name] = profile['spans'].get(name, 0.0) + seconds
+
+
+@contextmanager
+def profile_span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+class QueryRecorder: # connection.execute_wrapperに渡してSQLごとの時間を記録する
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile['queries'].append((sql, repr(params), time.perf_counter() - start))
+
+
+_template_timer_installed = False
+
+
+def install_template_timer():
+    """Djangoテンプレートの描画時間を測れるようにする。
+    include先はバックエンドのTemplate.renderを通らないので、外側の描画だけが数えられる"""
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    from django.template.backends.django import Template
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        with profile_span('template'):
+            return original(self, context, request)
+
+    Template.render = render
+    _template_timer_installed = True
+
+
+def summarize_queries(queries):
+    """(件数, 合計秒, 完全に同じSQLの重複数, パラメータ違いで繰り返されたSQL上位)"""
+    seen = set()
+    duplicates = 0
+    shapes = {}
+    for sql, params, _ in queries:
+        if (sql, params) in seen:
+            duplicates += 1
+        seen.add((sql, params))
+        shapes[sql] = shapes.get(sql, 0) + 1
+    repeated = sorted(((n, sql) for sql, n in shapes.items() if n > 1), reverse=True)[:3]
+    return len(queries), sum(q[2] for q in queries), duplicates, [{'count': n, 'sql': sql[:200]} for n, sql in repeated]
+
+
+@contextmanager
+def collect():
+    """この中で実行したSQLと内訳を集める。yieldした辞書の'total'に合計時間が入る"""
+    profile = {'queries': [], 'spans': {}}
+    token = _current.set(profile)
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(QueryRecorder(profile)))
+            yield profile
+    finally:
+        profile['total'] = time.perf_counter() - start
+        _current.reset(token)
+
+
+def log_profile(profile, url_name, **extra):
+    count, sql_seconds, duplicates, repeated = summarize_queries(profile['queries'])
+    logger.info(json.dumps(dict(
+        time=time.time(),
+        url_name=url_name,
+        **extra,
+        total_ms=round(profile['total'] * 1000, 3),
+        sql_count=count,
+        sql_ms=round(sql_seconds * 1000, 3),
+        duplicate_queries=duplicates,
+        repeated_queries=repeated,
+        template_ms=round(profile['spans'].get('template', 0.0) * 1000, 3),
+        image_ms=round(profile['spans'].get('image', 0.0) * 1000, 3),
+    ), ensure_ascii=False))
+
+
+@contextmanager
+def profile_job(name): # リクエスト外の処理（カード生成ジョブなど）も同じ形式で記録する
+    if not getattr(settings, 'REQUEST_PROFILING', False):
+        yield
+        return
+    with collect() as profile:
+        yield
+    log_profile(profile, name)
+
+
+class RequestProfilingMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        install_template_timer()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect() as profile:
+            response = self.get_response(request)
+        match = request.resolver_match
+        log_profile(
+            profile, match.view_name if match else None,
+            path=request.path, method=request.method, status=response.status_code,
+        )
+        return response
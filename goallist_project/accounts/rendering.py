@@ -0,0 +1,122 @@
+import hashlib
+import io
+import json
+import os
+from functools import lru_cache
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from .card_templates import CARD_TEMPLATES, DEFAULT_CARD_TEMPLATE
+from .profiling import profile_span
+
+# PIL は描画するときに初めて読み込む（URLconfを読むだけのワーカーに画像ライブラリを載せない）
+
+
+CARD_TEMPLATE_VERSION = 2 # 描画処理そのものを変えたら上げる（すべてのカードが作り直される）
+CARD_DIR = 'cards'
+
+
+@lru_cache(maxsize=None)
+def get_font(path, size): # フォントは(パス, サイズ)ごとに一度だけ読み込む
+    from PIL import ImageFont
+    return ImageFont.truetype(path, size)
+
+
+class CardPlan:
+    """テンプレートのレイアウトを描画できる形にしたもの。
+    デコード済みの下地画像と読み込み済みのフォント、行の高さを持ち、描画時は文字を置くだけにする。"""
+
+    def __init__(self, name, layout):
+        from PIL import Image
+        self.name = name
+        with Image.open(os.path.join(settings.STATIC_DIR, layout['base_image'])) as img:
+            base = img.convert('RGBA')
+        background = Image.new('RGBA', base.size, layout.get('background', (255, 255, 255)) + (255,))
+        self.base = Image.alpha_composite(background, base).convert('RGB') # 透過部分は背景色で塗る
+        self.color = layout['color']
+        font_path = layout.get('font', settings.CARD_FONT_PATH)
+        self.fields = []
+        for field in layout['fields']:
+            font = get_font(font_path, field['size'])
+            ascent, descent = font.getmetrics()
+            self.fields.append({
+                'name': field['name'],
+                'point': field['point'],
+                'font': font,
+                'max_width': field.get('max_width'),
+                'max_lines': field.get('max_lines', 1),
+                'line_height': int((ascent + descent) * 1.2),
+            })
+
+    def wrap(self, text, field): # 幅に収まるように1文字ずつ測って折り返す
+        if not field['max_width']:
+            return [text]
+        font, max_width = field['font'], field['max_width']
+        lines = []
+        for paragraph in text.splitlines() or ['']:
+            line = ''
+            for char in paragraph:
+                if line and font.getlength(line + char) > max_width:
+                    lines.append(line)
+                    line = ''
+                line += char
+            lines.append(line)
+        if len(lines) > field['max_lines']:
+            lines = lines[:field['max_lines']]
+            lines[-1] = lines[-1][:-1] + '…'
+        return lines
+
+    def render(self, fields): # PNGのバイト列を返す
+        from PIL import ImageDraw
+        img = self.base.copy()
+        draw = ImageDraw.Draw(img)
+        for field in self.fields:
+            x, y = field['point']
+            for i, line in enumerate(self.wrap(fields[field['name']], field)):
+                draw.text((x, y + i * field['line_height']), line, fill=self.color, font=field['font'])
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_plan(template): # テンプレートごとに一度だけ組み立ててプロセス内に保持する
+    return CardPlan(template, CARD_TEMPLATES[template])
+
+
+def card_fields(user, goal): # カードに描く文字列をまとめる
+    return {
+        'username': user.username,
+        'job': user.job,
+        'birthday': str(user.birthday),
+        'introduction': user.introduction,
+        'goal_title': goal.goal_title,
+        'goal_detail': goal.goal_detail,
+    }
+
+
+def render_card(fields, template=DEFAULT_CARD_TEMPLATE): # 6項目を一度に描画してPNGのバイト列を返す
+    with profile_span('image'):
+        return get_plan(template).render(fields)
+
+
+def card_digest(fields, template=DEFAULT_CARD_TEMPLATE): # 描画内容とテンプレートのバージョンから決まるハッシュ
+    version = [CARD_TEMPLATE_VERSION, template, CARD_TEMPLATES[template]['version']]
+    payload = json.dumps([version, fields], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_card_storage(): # MEDIA_ROOT直下に保存するので、Users.pictureからも同じ名前で参照できる
+    return storages['cards']
+
+
+def card_name(fields, template=DEFAULT_CARD_TEMPLATE):
+    return f'{CARD_DIR}/{card_digest(fields, template)}.png'
+
+
+def ensure_card(fields, template=DEFAULT_CARD_TEMPLATE): # 同じ内容のカードが保存済みなら描画せずにそのファイル名を返す
+    name = card_name(fields, template)
+    storage = get_card_storage()
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(render_card(fields, template)))
+    return name
@@ -0,0 +1,100 @@
+import re
+import unicodedata
+from django.db import connection
+from django.db.models import Prefetch, Q
+from django.db.models.expressions import RawSQL
+from .oncommit import add_on_commit
+
+
+# 夢の全文検索。日本語は単語の区切りが無いので、文字列を2文字ずつずらして区切った語（バイグラム）で索引を作る。
+# 「富士山」は "富士 士山" になり、検索語も同じように区切って「隣り合っている」ことを条件に探すので、部分一致と同じ結果になる。
+# SQLite: FTS5の仮想表 goal_search（goal_search_doc の内容をトリガーで反映する）
+# PostgreSQL: goal_search_doc.body の to_tsvector('simple') にGINの索引
+FTS_TABLE = 'goal_search'
+WORD_RE = re.compile(r'\w+')
+FIELD_SEPARATOR = 'sep' # 項目の間に入れる語。3文字なのでバイグラムとは重ならず、項目をまたいだフレーズ一致を防ぐ
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower() # 全角英数と半角カナをそろえる
+
+
+def bigrams(text):
+    tokens = []
+    for word in WORD_RE.findall(normalize(text)):
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def document_body(goal, task_titles):
+    """検索用の文書。先頭にユーザーを表す語（2文字以下のバイグラムとは重ならない）を入れ、他のユーザーの夢を索引の中で除外する。
+    夢のタイトル・詳細・タスク名の間にはFIELD_SEPARATORを挟む"""
+    parts = [goal.goal_title, goal.goal_detail, *task_titles]
+    return f' {FIELD_SEPARATOR} '.join([f'user{goal.user_id}'] + [' '.join(bigrams(part)) for part in parts if part])
+
+
+def refresh_documents(goal_ids, using=None):
+    """夢の検索用の文書を作り直す（消えた夢の文書は連鎖削除で消えている）"""
+    from .models import Goals, Tasks, SearchDocument
+    goal_ids = list(goal_ids)
+    if not goal_ids:
+        return
+    goals = Goals.objects.using(using).filter(pk__in=goal_ids).only('id', 'user_id', 'goal_title', 'goal_detail').prefetch_related(
+        Prefetch('tasks_set', queryset=Tasks.objects.only('id', 'goals_id', 'task_title').order_by('id'))
+    )
+    documents = [
+        SearchDocument(goal_id=goal.pk, user_id=goal.user_id, body=document_body(goal, [t.task_title for t in goal.tasks_set.all()]))
+        for goal in goals
+    ]
+    SearchDocument.objects.using(using).bulk_create(documents, update_conflicts=True, unique_fields=['goal'], update_fields=['user', 'body'])
+
+
+def schedule_refresh(goal_ids, using=None):
+    """コミット時にまとめて作り直す（タスクを何件変えても夢ごとに1回。削除中の夢には文書を作らない）。
+    登録はトランザクションごとに1回だけ（accounts.oncommit）。トランザクションの外ではその場で作り直す"""
+    add_on_commit(refresh_documents, goal_ids, using=using)
+
+
+def rebuild_fts():
+    """FTS5の索引を goal_search_doc から作り直す（PostgreSQLのGINは表と一緒に更新されるので不要）"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+
+
+def match_filter(user, query):
+    """検索語に一致する夢に絞り込むQ。検索語が1文字だけの語を含むときなどはNone（icontainsで探す）"""
+    words = WORD_RE.findall(normalize(query))
+    if not words or any(len(word) < 2 for word in words): # 1文字の語はバイグラムの索引では探せない
+        return None
+    terms = [tokens for tokens in map(bigrams, query.split()) if tokens]
+    if connection.vendor == 'sqlite':
+        # 語ごとに隣り合った並び（フレーズ）で探し、ユーザーを表す語とAND
+        expression = ' AND '.join([f'user{user.pk}'] + ['"' + ' '.join(tokens) + '"' for tokens in terms])
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]))
+    if connection.vendor == 'postgresql':
+        conditions = ' AND '.join(["to_tsvector('simple'::regconfig, body) @@ phraseto_tsquery('simple'::regconfig, %s)"] * len(terms))
+        return Q(pk__in=RawSQL(
+            f'SELECT goal_id FROM goal_search_doc WHERE user_id = %s AND {conditions}', [user.pk] + [' '.join(t) for t in terms],
+        ))
+    return None
+
+
+def icontains_search(queryset, query):
+    """索引を使わない検索（1文字の検索語や、索引の無いDBのとき。ベンチマークの比較にも使う）。
+    語ごとにfilterを分けるので、語が別々のタスクにあっても一致する（索引での検索と同じ）"""
+    for term in query.split():
+        queryset = queryset.filter(Q(goal_title__icontains=term) | Q(goal_detail__icontains=term) | Q(tasks__task_title__icontains=term))
+    return queryset
+
+
+def search_goals(user, query):
+    from .models import Goals
+    queryset = Goals.objects.filter(user=user)
+    condition = match_filter(user, query)
+    if condition is None:
+        return queryset.filter(pk__in=icontains_search(Goals.objects.filter(user=user), query).values('pk'))
+    return queryset.filter(condition)
@@ -0,0 +1,31 @@
+from datetime import datetime
+from django.conf import settings
+from django.contrib.sessions.backends import signed_cookies
+from django.core import signing
+from django.utils import timezone
+
+
+class SessionStore(signed_cookies.SessionStore):
+    """署名付きCookieのセッション。
+    Djangoの標準はset_expiry()を無視してSESSION_COOKIE_AGEで期限切れにする（#19201）ので、
+    「ログイン状態を保持する」の2週間が3日で切れないように、セッションごとの期限で署名の古さを確かめる"""
+
+    salt = 'django.contrib.sessions.backends.signed_cookies'
+
+    def _loads(self, max_age):
+        return signing.loads(self.session_key, serializer=self.serializer, max_age=max_age, salt=self.salt)
+
+    def load(self):
+        longest = max(settings.SESSION_COOKIE_AGE, settings.SESSION_REMEMBER_AGE)
+        try:
+            data = self._loads(longest)
+            expiry = data.get('_session_expiry')
+            if isinstance(expiry, str): # 日時で指定されたときは、その日時を過ぎたかだけを見る
+                if datetime.fromisoformat(expiry) <= timezone.now():
+                    raise signing.SignatureExpired
+            elif (expiry or settings.SESSION_COOKIE_AGE) < longest:
+                self._loads(expiry or settings.SESSION_COOKIE_AGE)
+            return data
+        except Exception: # 署名の不一致・期限切れ・壊れた値はすべて新しいセッションにする
+            self.create()
+        return {}
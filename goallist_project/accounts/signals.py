@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Users, Goals, Tasks
+from .fragments import bump_user_version, bump_goal_owners
+from .backends import forget_user
+from .search import schedule_refresh
+
+
+@receiver(post_save, sender=Goals)
+def count_loaded_goal(sender, instance, created, raw=False, using=None, **kwargs):
+    # loaddataはGoals.saveを通らない（上限は確かめず、削除時に減らす分と釣り合うように数えるだけ）
+    if raw and created:
+        Users.objects.using(using).filter(pk=instance.user_id).update(goal_count=F('goal_count') + 1)
+
+
+@receiver(post_delete, sender=Goals)
+def decrement_goal_count(sender, instance, **kwargs):
+    # QuerySet.delete()やユーザー削除による連鎖削除でも1件ごとに呼ばれる
+    Users.objects.filter(pk=instance.user_id).update(goal_count=F('goal_count') - 1)
+
+
+# 画面の断片キャッシュを無効にする（ユーザーのバージョンを上げるだけ）
+@receiver(post_save, sender=Goals)
+@receiver(post_delete, sender=Goals)
+def invalidate_goal_fragments(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+
+def deleted_with_parent(origin):
+    """夢やユーザーの削除による連鎖削除か。そのときは夢・ユーザー側の処理で足りるので、タスクごとには何もしない"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Goals, Users)
+
+
+@receiver(post_save, sender=Tasks)
+def invalidate_task_fragments(sender, instance, using=None, **kwargs):
+    bump_goal_owners([instance.goals_id], using=using)
+
+
+@receiver(post_delete, sender=Tasks)
+def invalidate_deleted_task_fragments(sender, instance, using=None, origin=None, **kwargs):
+    if not deleted_with_parent(origin):
+        bump_goal_owners([instance.goals_id], using=using)
+
+
+@receiver(post_save, sender=Users)
+def invalidate_user_fragments(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}: # ログインのたびには消さない
+        return
+    bump_user_version(instance.pk)
+
+
+# 検索用の文書を作り直す（夢の削除時は連鎖削除で消える）。update_fieldsが文書に関係ない項目だけなら作り直さない
+GOAL_SEARCH_FIELDS = {'user', 'goal_title', 'goal_detail'}
+TASK_SEARCH_FIELDS = {'goals', 'task_title'}
+
+
+@receiver(post_save, sender=Goals)
+def refresh_goal_search(sender, instance, using=None, update_fields=None, **kwargs):
+    if update_fields is not None and not GOAL_SEARCH_FIELDS & set(update_fields):
+        return
+    schedule_refresh([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Tasks)
+def refresh_task_search(sender, instance, using=None, update_fields=None, **kwargs):
+    if update_fields is not None and not TASK_SEARCH_FIELDS & set(update_fields):
+        return
+    schedule_refresh([instance.goals_id], using=using)
+
+
+@receiver(post_delete, sender=Tasks)
+def refresh_deleted_task_search(sender, instance, using=None, origin=None, **kwargs):
+    if not deleted_with_parent(origin):
+        schedule_refresh([instance.goals_id], using=using)
+
+
+# ログイン中のユーザーのキャッシュ（accounts.backends）を消す
+@receiver(post_save, sender=Users)
+@receiver(post_delete, sender=Users)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    # SQLiteはWALモードなどを接続ごとに設定する（複数ワーカーで"database is locked"を避ける）
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma in settings.SQLITE_PRAGMAS:
+            cursor.execute(pragma)
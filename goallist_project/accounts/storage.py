@@ -0,0 +1,30 @@
+import os
+import tempfile
+from django.core.files.storage import FileSystemStorage
+
+
+class CardStorage(FileSystemStorage):
+    """内容のハッシュをファイル名にしたカード用のストレージ。
+    同じ名前なら中身も同じなので、名前をずらさず一時ファイルからの置き換えで保存する。
+    並列に同じカードを書いても、読む側が書きかけのファイルを見ることはない。"""
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path) # 同じディレクトリ内なので置き換えは原子的
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
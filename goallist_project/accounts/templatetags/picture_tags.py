@@ -0,0 +1,36 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from ..variants import VARIANT_WIDTHS, supported_formats, variant_name, get_variant_storage
+
+register = template.Library()
+
+
+def _variant_url(storage, name, width, fmt):
+    target = variant_name(name, width, fmt)
+    if storage.exists(target):
+        return storage.url(target)
+    # まだ無い縮小版は、初回アクセス時にビューで作る
+    return reverse('accounts:picture_variant', kwargs={'width': width, 'fmt': fmt, 'name': name})
+
+
+@register.simple_tag
+def responsive_picture(picture, alt='', sizes='100vw', css_class=''):
+    """画像(FileFieldまたはファイル名)を、幅違い・形式違いのsrcset付き<picture>タグで出す
+    使い方: {% load picture_tags %}{% responsive_picture user.picture alt="プロフィール" sizes="160px" %}"""
+    name = getattr(picture, 'name', picture)
+    if not name:
+        return ''
+    storage = get_variant_storage()
+
+    def srcset(fmt):
+        return ', '.join(f'{_variant_url(storage, name, width, fmt)} {width}w' for width in VARIANT_WIDTHS)
+
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((fmt, srcset(fmt), sizes) for fmt in supported_formats() if fmt != 'png'),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        sources, storage.url(name), srcset('png'), sizes, alt, css_class,
+    )
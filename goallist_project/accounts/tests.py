@@ -1,3 +1,780 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY, authenticate
+from django.contrib.auth.backends import ModelBackend
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import fragments, jobs, search, transfer
+from .api import MAX_BULK_TASKS
+from .backends import clear_user_cache
+from .card_templates import CARD_TEMPLATES, DEFAULT_CARD_TEMPLATE, check_card_templates, validate_layout
+from .downloads import RangeNotSatisfiable, parse_range
+from .fragments import FRAGMENT_CACHE
+from .management.commands.bench_accounts import QUERY_BUDGETS, READ_ONLY, WRITE_RE
+from .management.commands.profile_report import percentile
+from .models import MAX_GOALS, Users, Goals, Tasks, SearchDocument
+from .rendering import card_fields, card_name, get_card_storage
+from .search import FIELD_SEPARATOR, search_goals
 
-# Create your tests here.
+
+PASSWORD = 'test-Pa55word!'
+
+# 画面ごとのSQL数（キャッシュが空の状態での1回目）。意図して変えたときはここも直す。上限はbench_accountsのQUERY_BUDGETS
+EXPECTED_QUERIES = {
+    'login': 9,
+    'goal_list': 3,
+    'goal_detail': 4,
+    'goal_create': 11,
+    'goal_edit': 11,
+    'goal_delete': 10,
+    'card_generate': 4,
+    'picture_download': 1,
+}
+
+
+class AccountsTestCase(TransactionTestCase):
+    """on_commit（検索用の文書の作り直しなど）が本番と同じくその場で実行されるように、TransactionTestCaseを使う。
+    MEDIA_ROOTは一時ディレクトリに置き換え、プロセス内のキャッシュは毎回空にする"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        caches[FRAGMENT_CACHE].clear()
+        clear_user_cache()
+
+    def create_user(self, name='test', goals=5, tasks=3):
+        user = Users.objects.create_user(name, f'{name}@example.com', PASSWORD)
+        Goals.objects.bulk_create([Goals(user=user, goal_title=f'夢{i}', goal_detail=f'詳細{i}') for i in range(goals)])
+        Tasks.objects.bulk_create([
+            Tasks(goals=goal, task_title=f'タスク{j}', task_priority=j, task_condition=j % 2 == 0)
+            for goal in Goals.objects.filter(user=user) for j in range(tasks)
+        ])
+        return user
+
+
+class QueryBudgetTests(AccountsTestCase):
+    """bench_accounts --check と同じ上限を manage.py test でも確かめる（N+1やGETでの書き込みの検出用）"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.goal_ids = list(Goals.objects.filter(user=self.user).values_list('pk', flat=True))
+        self.client.force_login(self.user)
+        caches[FRAGMENT_CACHE].clear()
+        clear_user_cache()
+
+    def request(self, name, method, url, data=None):
+        self.assertLessEqual(EXPECTED_QUERIES[name], QUERY_BUDGETS[name])
+        with self.assertNumQueries(EXPECTED_QUERIES[name]):
+            response = getattr(self.client, method)(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_login(self):
+        self.client.logout()
+        self.request('login', 'post', reverse('accounts:user_login'), {'username': self.user.address, 'password': PASSWORD})
+
+    def test_goal_list(self):
+        self.request('goal_list', 'get', reverse('accounts:goal_list', kwargs={'pk': self.user.pk}))
+
+    def test_goal_detail(self):
+        self.request('goal_detail', 'get', reverse('accounts:goal_detail', kwargs={'pk': self.goal_ids[0]}))
+
+    def test_goal_create(self):
+        self.request('goal_create', 'post', reverse('accounts:goal_regist'), {'goal_title': '新しい夢', 'goal_detail': '詳細'})
+        self.assertEqual(Goals.objects.filter(user=self.user).count(), 6)
+
+    def test_goal_edit(self):
+        self.request('goal_edit', 'post', reverse('accounts:goal_edit', kwargs={'pk': self.goal_ids[0]}), {'goal_title': '編集', 'goal_detail': '詳細'})
+
+    def test_goal_delete(self):
+        self.request('goal_delete', 'post', reverse('accounts:goal_delete', kwargs={'pk': self.goal_ids[0]}))
+        self.assertFalse(Goals.objects.filter(pk=self.goal_ids[0]).exists())
+
+    def test_card_generate(self):
+        goal = Goals.objects.get(pk=self.goal_ids[0])
+        get_card_storage().save(card_name(card_fields(self.user, goal)), ContentFile(b'card')) # 描画済みのカードを使う経路
+        self.request('card_generate', 'get', reverse('accounts:pict_generate', kwargs={'pk': goal.pk}))
+
+    def test_picture_download(self):
+        self.user.picture.save('picture.png', ContentFile(b'picture'))
+        clear_user_cache()
+        self.request('picture_download', 'get', reverse('accounts:download_profile_picture', kwargs={'pk': self.user.pk}))
+
+    def test_read_only_views_do_not_write(self):
+        self.user.picture.save('picture.png', ContentFile(b'picture'))
+        urls = {
+            'goal_list': reverse('accounts:goal_list', kwargs={'pk': self.user.pk}),
+            'goal_detail': reverse('accounts:goal_detail', kwargs={'pk': self.goal_ids[0]}),
+            'picture_download': reverse('accounts:download_profile_picture', kwargs={'pk': self.user.pk}),
+        }
+        self.assertEqual(set(urls), READ_ONLY)
+        for name, url in urls.items():
+            for attempt in range(2): # キャッシュが空のときと、効いているとき
+                with self.subTest(name=name, attempt=attempt), CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual([q['sql'] for q in queries.captured_queries if WRITE_RE.match(q['sql'])], [])
+
+
+class PictStatusTests(AccountsTestCase):
+    """カードの生成状況（pict_status）は本人のジョブだけを見せ、失敗したジョブは一度伝えたら忘れる"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=0)
+        self.job_id = f'{self.user.pk}-{"0" * 64}'
+        self.url = reverse('accounts:pict_status', kwargs={'job_id': self.job_id})
+        self.addCleanup(jobs._jobs.pop, self.job_id, None)
+        self.addCleanup(jobs._failed_at.pop, self.job_id, None)
+
+    def test_requires_login(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_other_users_job_is_not_found(self):
+        self.client.force_login(self.create_user('other', goals=0))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_malformed_job_id_is_not_found(self):
+        self.client.force_login(self.user)
+        url = reverse('accounts:pict_status', kwargs={'job_id': f'{self.user.pk}-xyz'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_pending_job(self):
+        self.client.force_login(self.user)
+        jobs._jobs[self.job_id] = Future()
+        self.assertEqual(self.client.get(self.url).json(), {'status': 'pending'})
+
+    def test_failed_job_is_forgotten_once_reported(self):
+        self.client.force_login(self.user)
+        future = Future()
+        future.set_exception(RuntimeError('描画に失敗'))
+        jobs._jobs[self.job_id] = future
+        jobs._forget(self.job_id, future)
+        self.assertIn(self.job_id, jobs._failed_at)
+        self.assertEqual(self.client.get(self.url).json(), {'status': 'failed'})
+        self.assertNotIn(self.job_id, jobs._jobs)
+        self.assertNotIn(self.job_id, jobs._failed_at)
+
+    def test_unread_failures_expire(self):
+        future = Future()
+        future.set_exception(RuntimeError('描画に失敗'))
+        jobs._jobs[self.job_id] = future
+        jobs._failed_at[self.job_id] = time.monotonic() - jobs.FAILED_JOB_TTL - 1
+        done = Future()
+        done.set_result('card.png')
+        jobs._forget('other-job', done) # 別のジョブが終わったときにまとめて掃除される
+        self.assertNotIn(self.job_id, jobs._jobs)
+        self.assertNotIn(self.job_id, jobs._failed_at)
+
+
+class PercentileTests(SimpleTestCase):
+    """最近傍順位法：順位は ceil(p/100 * n)"""
+
+    def test_nearest_rank(self):
+        values = list(range(1, 21)) # 1〜20
+        self.assertEqual(percentile(values, 50), 10)
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 99), 20)
+        self.assertEqual(percentile(values, 100), 20)
+
+    def test_rounds_rank_up(self):
+        self.assertEqual(percentile([1, 2, 3], 50), 2) # 1.5番目は2番目
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 90), 5) # 並べ替えてから選ぶ
+
+    def test_edges(self):
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([1, 2, 3], 0), 1)
+
+
+class AuthenticationBackendTests(AccountsTestCase):
+    """CachedModelBackendに切り替える前のセッション（ModelBackend）でもログインしたままでいられる"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=1)
+
+    def test_legacy_session_stays_logged_in(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('accounts:goal_list', kwargs={'pk': self.user.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(self.client.session[SESSION_KEY]), self.user.pk)
+
+    def test_login_uses_cached_backend(self):
+        user = authenticate(username=self.user.address, password=PASSWORD)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.backend, 'accounts.backends.CachedModelBackend')
+
+    def test_wrong_password_is_hashed_once(self):
+        with mock.patch.object(ModelBackend, 'authenticate', autospec=True, side_effect=ModelBackend.authenticate) as backend:
+            self.assertIsNone(authenticate(username=self.user.address, password='wrong-password'))
+        self.assertEqual(backend.call_count, 1) # 後ろのModelBackendまで進まない
+
+
+class SearchTests(AccountsTestCase):
+    """夢の検索（索引はコミット時に1回だけ作り直し、項目をまたいだフレーズには一致しない）"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=0)
+
+    def create_goal(self, title, detail, tasks=()):
+        with transaction.atomic():
+            goal = Goals.objects.create(user=self.user, goal_title=title, goal_detail=detail)
+            for task_title in tasks:
+                Tasks.objects.create(goals=goal, task_title=task_title)
+        return goal
+
+    def test_finds_goal_by_each_field(self):
+        goal = self.create_goal('東京に住む', '家を探す', ['不動産屋に行く'])
+        for query in ['東京', '家を', '不動産']:
+            with self.subTest(query=query):
+                self.assertEqual(list(search_goals(self.user, query)), [goal])
+
+    def test_phrase_does_not_span_fields(self):
+        self.create_goal('夢の東京', '京都に行く')
+        self.assertIn(f' {FIELD_SEPARATOR} ', SearchDocument.objects.get().body)
+        self.assertEqual(list(search_goals(self.user, '東京都')), []) # タイトルの「東京」と詳細の「京都」はつながらない
+
+    def test_does_not_find_other_users_goals(self):
+        self.create_goal('東京に住む', '家を探す')
+        self.assertEqual(list(search_goals(self.create_user('other', goals=0), '東京')), [])
+
+    def test_refreshes_once_per_transaction(self):
+        with mock.patch.object(search, 'refresh_documents', wraps=search.refresh_documents) as refresh:
+            goal = self.create_goal('東京に住む', '家を探す', ['タスク1', 'タスク2', 'タスク3'])
+        refresh.assert_called_once()
+        self.assertEqual(set(refresh.call_args.args[0]), {goal.pk})
+        self.assertIn(' '.join(search.bigrams('タスク3')), SearchDocument.objects.get(goal=goal).body)
+
+    def test_refresh_uses_the_querysets_database(self):
+        goal = self.create_goal('東京に住む', '家を探す')
+        with mock.patch.object(search, 'refresh_documents', wraps=search.refresh_documents) as refresh, transaction.atomic(using='default'):
+            Tasks.objects.using('default').bulk_create([Tasks(goals=goal, task_title='不動産屋に行く')])
+        refresh.assert_called_once_with({goal.pk}, 'default')
+        self.assertEqual(list(search_goals(self.user, '不動産')), [goal])
+
+    def test_rolled_back_changes_are_not_refreshed(self):
+        with mock.patch.object(search, 'refresh_documents', wraps=search.refresh_documents) as refresh:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Goals.objects.create(user=self.user, goal_title='消える夢', goal_detail='')
+                raise RuntimeError
+            goal = self.create_goal('残る夢', '')
+        refresh.assert_called_once()
+        self.assertEqual(set(refresh.call_args.args[0]), {goal.pk})
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', TASK_REMINDER_DAYS=1, TASK_REMINDER_OVERDUE_DAYS=7)
+class TaskReminderTests(AccountsTestCase):
+    """send_task_reminders：ユーザーごとに1通、同じタスクは2回知らせない、無効なユーザーには送らない"""
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        self.user = self.create_user(goals=1, tasks=0)
+        self.goal = Goals.objects.get(user=self.user)
+
+    def create_task(self, title, days=0, done=False, goal=None):
+        return Tasks.objects.create(goals=goal or self.goal, task_title=title, task_due=self.today + datetime.timedelta(days=days), task_condition=done)
+
+    def send(self):
+        call_command('send_task_reminders', stdout=io.StringIO())
+
+    def test_one_digest_per_user(self):
+        due = [self.create_task('今日', 0), self.create_task('明日', 1), self.create_task('先週', -7)]
+        self.create_task('来週', 7)
+        self.create_task('完了', 0, done=True)
+        self.send()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.address])
+        self.assertEqual(set(Tasks.objects.filter(reminded_at__isnull=False)), set(due))
+
+    def test_does_not_remind_twice(self):
+        self.create_task('今日')
+        self.send()
+        self.send()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_inactive_users_tasks_are_not_claimed(self):
+        task = self.create_task('今日')
+        Users.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.send()
+        self.assertEqual(mail.outbox, [])
+        task.refresh_from_db()
+        self.assertIsNone(task.reminded_at) # 有効に戻ったら知らせられるように、印を付けない
+
+    def test_rescheduled_task_is_reminded_again(self):
+        task = self.create_task('今日')
+        self.send()
+        task = Tasks.objects.get(pk=task.pk)
+        task.task_due = self.today + datetime.timedelta(days=1)
+        task.save(update_fields=['task_due'])
+        self.assertIsNone(Tasks.objects.get(pk=task.pk).reminded_at)
+        self.send()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_unrelated_change_keeps_reminder(self):
+        task = self.create_task('今日')
+        self.send()
+        task = Tasks.objects.get(pk=task.pk)
+        task.task_title = '名前だけ変える'
+        task.save()
+        self.assertIsNotNone(Tasks.objects.get(pk=task.pk).reminded_at)
+
+    def test_send_failure_releases_claim(self):
+        task = self.create_task('今日')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError), self.assertRaises(OSError):
+            self.send()
+        task.refresh_from_db()
+        self.assertIsNone(task.reminded_at) # 次の実行でもう一度拾う
+
+
+class AsyncDownloadTests(AccountsTestCase):
+    """ASGIの画像のダウンロードは、ファイルのサイズの取得や開く処理でイベントループを止めない"""
+
+    async def test_file_is_opened_off_the_event_loop(self):
+        user = await sync_to_async(self.create_user)(goals=0)
+        await sync_to_async(user.picture.save)('picture.png', ContentFile(b'0123456789'))
+        loop_thread = threading.current_thread()
+        calls = []
+        size, open_ = FileSystemStorage.size, FileSystemStorage.open
+
+        def record(method):
+            def wrapper(storage, *args, **kwargs):
+                calls.append(threading.current_thread())
+                return method(storage, *args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(FileSystemStorage, 'size', record(size)), mock.patch.object(FileSystemStorage, 'open', record(open_)):
+            response = await self.async_client.get(reverse('accounts:async_download_profile_picture', kwargs={'pk': user.pk}))
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, b'0123456789')
+        self.assertEqual(len(calls), 2)
+        self.assertNotIn(loop_thread, calls)
+
+    async def test_range(self):
+        user = await sync_to_async(self.create_user)(goals=0)
+        await sync_to_async(user.picture.save)('picture.png', ContentFile(b'0123456789'))
+        url = reverse('accounts:async_download_profile_picture', kwargs={'pk': user.pk})
+        response = await self.async_client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'2345')
+        response = await self.async_client.get(url, headers={'Range': 'bytes=0-1,5-6'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'0123456789')
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_ranges(self):
+        for header, expected in [
+            ('bytes=2-5', (2, 5)),
+            ('bytes=7-', (7, 9)),
+            ('bytes=8-100', (8, 9)), # 末尾を超える指定は末尾まで
+            ('bytes=-3', (7, 9)),
+            ('bytes=-100', (0, 9)), # ファイルより長い末尾の指定はファイル全体
+            (' bytes=0-0 ', (0, 0)),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 10), expected)
+
+    def test_unsupported_headers_are_ignored(self):
+        for header in ['bytes=0-1,5-6', 'items=0-1', 'bytes=5-2', 'bytes=-', 'bytes=a-b', '']:
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 10))
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in [('bytes=10-', 10), ('bytes=10-20', 10), ('bytes=-0', 10), ('bytes=0-', 0), ('bytes=-5', 0)]:
+            with self.subTest(header=header, size=size), self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, size)
+
+
+class DownloadTests(AccountsTestCase):
+    """プロフィール画像のダウンロード（Range・If-Range・条件付きGET）"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=0)
+        self.user.picture.save('picture.png', ContentFile(b'0123456789'))
+        self.url = reverse('accounts:download_profile_picture', kwargs={'pk': self.user.pk})
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+    def test_range(self):
+        response, body = self.get(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+    def test_suffix_range(self):
+        response, body = self.get(Range='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'789')
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_unsupported_range_returns_whole_file(self):
+        for header in ['bytes=0-1,5-6', 'items=0-1', 'bytes=5-2']:
+            with self.subTest(header=header):
+                response, body = self.get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, b'0123456789')
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, body = self.get(Range='bytes=0-1', If_Range=etag)
+        self.assertEqual((response.status_code, body), (206, b'01'))
+        response, body = self.get(Range='bytes=0-1', If_Range='"changed"') # 変わっていたらファイル全体
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+
+    def test_not_modified(self):
+        first = self.get()[0]
+        self.assertEqual(self.get(If_None_Match=first['ETag'])[0].status_code, 304)
+        self.assertEqual(self.get(If_Modified_Since=first['Last-Modified'])[0].status_code, 304)
+
+    def test_not_found(self):
+        self.assertEqual(self.client.get(reverse('accounts:download_profile_picture', kwargs={'pk': self.user.pk + 1})).status_code, 404)
+        Users.objects.filter(pk=self.user.pk).update(picture='')
+        self.assertEqual(self.get()[0].status_code, 404)
+
+
+class FragmentInvalidationTests(AccountsTestCase):
+    """タスクの変更で夢の持ち主の断片を無効にする処理は、トランザクションごとに1回だけ、コミットしたときだけ行う"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=2, tasks=0)
+        self.goals = list(Goals.objects.filter(user=self.user).order_by('pk'))
+
+    def bumps(self):
+        return mock.patch.object(fragments, '_bump_goal_owners', wraps=fragments._bump_goal_owners)
+
+    def test_registers_once_per_transaction(self):
+        with self.bumps() as bump, transaction.atomic():
+            for goal in self.goals:
+                for i in range(3):
+                    Tasks.objects.create(goals=goal, task_title=f'タスク{i}')
+            self.assertEqual(bump.call_count, 0)
+        bump.assert_called_once()
+        self.assertEqual(bump.call_args.args[0], {goal.pk for goal in self.goals})
+
+    def test_rolled_back_ids_do_not_leak(self):
+        with self.bumps() as bump:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Tasks.objects.create(goals=self.goals[0], task_title='消える')
+                raise RuntimeError
+            with transaction.atomic():
+                Tasks.objects.create(goals=self.goals[1], task_title='残る')
+        bump.assert_called_once()
+        self.assertEqual(bump.call_args.args[0], {self.goals[1].pk})
+
+    def test_savepoint_rollback(self):
+        with self.bumps() as bump, transaction.atomic():
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Tasks.objects.create(goals=self.goals[0], task_title='消える')
+                raise RuntimeError
+            Tasks.objects.create(goals=self.goals[1], task_title='残る')
+        bump.assert_called_once()
+        self.assertEqual(bump.call_args.args[0], {self.goals[1].pk})
+
+    def test_bulk_created_tasks_bump_owner(self):
+        version = fragments.get_user_version(self.user.pk)
+        Tasks.objects.bulk_create([Tasks(goals=self.goals[0], task_title='一括')])
+        self.assertNotEqual(fragments.get_user_version(self.user.pk), version)
+
+
+class TasksBulkTests(AccountsTestCase):
+    """タスクの一括操作API（api/goals/<pk>/tasks/bulk）"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=1, tasks=3)
+        self.goal = Goals.objects.get(user=self.user)
+        self.task_ids = list(Tasks.objects.filter(goals=self.goal).order_by('pk').values_list('pk', flat=True))
+        self.client.force_login(self.user)
+
+    def post(self, payload, goal=None):
+        url = reverse('accounts:tasks_bulk', kwargs={'pk': (goal or self.goal).pk})
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        return self.client.post(url, body, content_type='application/json')
+
+    def test_all_operations_in_one_request(self):
+        first, second, third = self.task_ids
+        response = self.post({
+            'create': [{'task_title': '新しいタスク', 'task_due': '2030-01-01'}],
+            'reorder': [third, first],
+            'complete': [first],
+            'delete': [second],
+        })
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(len(result['created']), 1)
+        self.assertEqual((result['reordered'], result['completed'], result['deleted']), (2, 1, 1))
+        tasks = {task.pk: task for task in Tasks.objects.filter(goals=self.goal)}
+        self.assertNotIn(second, tasks)
+        self.assertEqual((tasks[third].task_priority, tasks[first].task_priority), (0, 1))
+        self.assertTrue(tasks[first].task_condition)
+        created = tasks[result['created'][0]]
+        self.assertEqual((created.task_title, str(created.task_due)), ('新しいタスク', '2030-01-01'))
+
+    def test_other_users_goal_is_not_found(self):
+        other = self.create_user('other', goals=1, tasks=1)
+        response = self.post({'delete': []}, goal=Goals.objects.get(user=other))
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_goals_tasks_are_not_touched(self):
+        other = self.create_user('other', goals=1, tasks=1)
+        task = Tasks.objects.get(goals__user=other)
+        Tasks.objects.filter(pk=task.pk).update(task_condition=False)
+        task.refresh_from_db()
+        self.assertEqual(self.post({'complete': [task.pk], 'delete': [task.pk]}).json()['deleted'], 0)
+        self.assertEqual(Tasks.objects.get(pk=task.pk).upload_at, task.upload_at) # 完了にもなっていない
+
+    def test_invalid_bodies(self):
+        for body in ['[1, 2]', '"text"', 'not json', json.dumps({'create': {}}), json.dumps({'delete': ['1']}), json.dumps({'delete': [True]})]:
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        self.assertEqual(Tasks.objects.filter(goals=self.goal).count(), 3)
+
+    def test_invalid_task_fields(self):
+        response = self.post({'create': [{'task_title': '正しい'}, {'task_title': ''}, {'task_title': 'x', 'task_due': '明日'}, 'text']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']['create']), {'1', '2', '3'})
+        self.assertEqual(Tasks.objects.filter(goals=self.goal).count(), 3) # 1件でも誤りがあれば何も作らない
+
+    def test_limit(self):
+        response = self.post({'create': [{'task_title': 'x'}] * MAX_BULK_TASKS, 'delete': [self.task_ids[0]]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Tasks.objects.filter(goals=self.goal).count(), 3)
+        response = self.post({'create': [{'task_title': 'x'}] * (MAX_BULK_TASKS - 1), 'delete': [self.task_ids[0]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Tasks.objects.filter(goals=self.goal).count(), 2 + MAX_BULK_TASKS - 1)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.post({}).status_code, 302)
+
+
+class GoalCountTests(AccountsTestCase):
+    """Users.goal_count は常に実際の夢の数と等しく、MAX_GOALSを超えない"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=3, tasks=1)
+
+    def assertCount(self, user=None):
+        user = user or self.user
+        expected = Goals.objects.filter(user=user).count()
+        self.assertEqual(Users.objects.get(pk=user.pk).goal_count, expected)
+        return expected
+
+    def test_create_and_edit(self):
+        goal = Goals.objects.create(user=self.user, goal_title='夢', goal_detail='')
+        self.assertEqual(self.assertCount(), 4)
+        goal.goal_title = '編集'
+        goal.save()
+        self.assertEqual(self.assertCount(), 4)
+
+    def test_create_with_explicit_id(self):
+        next_id = Goals.objects.order_by('-pk').first().pk + 1
+        Goals(id=next_id, user=self.user, goal_title='夢', goal_detail='').save()
+        Goals(id=next_id + 1, user=self.user, goal_title='夢', goal_detail='').save(force_insert=True)
+        self.assertEqual(self.assertCount(), 5)
+        Goals.objects.get(pk=next_id).delete()
+        self.assertEqual(self.assertCount(), 4)
+
+    def test_loaddata(self):
+        next_id = Goals.objects.order_by('-pk').first().pk + 1
+        fixture = os.path.join(tempfile.mkdtemp(), 'goals.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(fixture), ignore_errors=True)
+        with open(fixture, 'w', encoding='utf-8') as f:
+            json.dump([{'model': 'accounts.goals', 'pk': next_id, 'fields': {
+                'user': self.user.pk, 'goal_title': '読み込んだ夢', 'goal_detail': '', 'goal_condition': 0,
+                'created_at': '2026-01-01T00:00:00Z', 'upload_at': '2026-01-01T00:00:00Z',
+            }}], f)
+        call_command('loaddata', fixture, verbosity=0)
+        call_command('loaddata', fixture, verbosity=0) # 2回目は更新なので数えない
+        self.assertEqual(self.assertCount(), 4)
+
+    def test_queryset_delete(self):
+        Goals.objects.filter(user=self.user).delete()
+        self.assertEqual(self.assertCount(), 0)
+
+    def test_user_delete_cascades(self):
+        other = self.create_user('other', goals=2, tasks=1)
+        self.user.delete()
+        self.assertFalse(Goals.objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(self.assertCount(other), 2)
+
+    def test_limit(self):
+        Goals.objects.bulk_create([Goals(user=self.user, goal_title='夢', goal_detail='') for _ in range(MAX_GOALS - 3)])
+        self.assertEqual(self.assertCount(), MAX_GOALS)
+        with self.assertRaises(ValidationError):
+            Goals.objects.create(user=self.user, goal_title='上限を超える', goal_detail='')
+        self.assertEqual(self.assertCount(), MAX_GOALS)
+
+    def test_bulk_create_over_limit(self):
+        with self.assertRaises(ValidationError):
+            Goals.objects.bulk_create([Goals(user=self.user, goal_title='夢', goal_detail='') for _ in range(MAX_GOALS - 2)])
+        self.assertEqual(self.assertCount(), 3) # 1件も作らない
+
+    def test_regist_view_over_limit(self):
+        Users.objects.filter(pk=self.user.pk).update(goal_count=MAX_GOALS)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('accounts:goal_regist'), {'goal_title': '上限を超える', 'goal_detail': ''})
+        self.assertEqual(response.status_code, 200) # 500ではなく、フォームに戻してエラーを表示する
+        self.assertContains(response, '夢リストの上限に達しました。')
+        self.assertEqual(Goals.objects.filter(user=self.user).count(), 3)
+
+    def test_rebuild_goal_counts(self):
+        other = self.create_user('other', goals=2, tasks=0)
+        Users.objects.update(goal_count=50)
+        call_command('rebuild_goal_counts', stdout=io.StringIO())
+        self.assertCount()
+        self.assertCount(other)
+
+
+class GoalTransferTests(AccountsTestCase):
+    """夢リストの書き出し（CSV / JSON Lines）と読み込み"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(goals=3, tasks=2)
+        Goals.objects.create(user=self.user, goal_title='タスクの無い夢', goal_detail='詳細, "引用符"')
+        self.other = self.create_user('other', goals=0)
+
+    def export(self, fmt):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('accounts:goals_export', kwargs={'fmt': fmt}))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def upload(self, content, name='goals.csv', user=None):
+        self.client.force_login(user or self.other)
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        return self.client.post(reverse('accounts:goals_import'), {'file': SimpleUploadedFile(name, data)})
+
+    def snapshot(self, user):
+        return sorted(
+            (goal.goal_title, goal.goal_detail, goal.goal_condition,
+             tuple(sorted((t.task_title, t.task_priority, t.task_due, t.task_condition) for t in goal.tasks_set.all())))
+            for goal in Goals.objects.filter(user=user).prefetch_related('tasks_set')
+        )
+
+    def test_round_trip(self):
+        for fmt in ['csv', 'jsonl']:
+            with self.subTest(fmt=fmt):
+                Goals.objects.filter(user=self.other).delete()
+                response = self.upload(self.export(fmt), name=f'goals.{fmt}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {'goals': 4, 'tasks': 6})
+                self.assertEqual(self.snapshot(self.other), self.snapshot(self.user))
+                self.assertEqual(Users.objects.get(pk=self.other.pk).goal_count, 4)
+
+    def test_csv_has_bom(self):
+        self.assertTrue(self.export('csv').startswith('\ufeffgoal_ref,'.encode('utf-8')))
+
+    def test_row_errors(self):
+        content = 'goal_ref,goal_title,task_title,task_due\n1,正しい夢,タスク,2030-01-01\n2,' + '長' * 16 + ',,\n3,夢,タスク,明日\n'
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['line'] for error in response.json()['errors']], [2, 3])
+        self.assertFalse(Goals.objects.filter(user=self.other).exists())
+
+    def test_rolls_back_flushed_batches(self):
+        rows = ''.join(f'{i},夢{i},タスク{i}\n' for i in range(10))
+        with mock.patch.object(transfer, 'IMPORT_BATCH_SIZE', 4): # 途中までbulk_createしてから最後の行で失敗する
+            response = self.upload('goal_ref,goal_title,task_title\n' + rows + '99,,\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['line'], 11)
+        self.assertFalse(Goals.objects.filter(user=self.other).exists())
+        self.assertFalse(Tasks.objects.filter(goals__user=self.other).exists())
+        self.assertEqual(Users.objects.get(pk=self.other.pk).goal_count, 0)
+
+    def test_over_limit(self):
+        Goals.objects.bulk_create([Goals(user=self.other, goal_title='夢', goal_detail='') for _ in range(MAX_GOALS - 1)])
+        response = self.upload('goal_ref,goal_title\n1,夢A\n2,夢B\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{'line': None, 'error': ['夢リストの上限に達しました。']}])
+        self.assertEqual(Goals.objects.filter(user=self.other).count(), MAX_GOALS - 1)
+
+    def test_jsonl_line_must_be_an_object(self):
+        response = self.upload('{"goal_title": "夢"}\n[1, 2]\n', name='goals.jsonl')
+        self.assertEqual(response.status_code, 400)
+        error = response.json()['errors'][0]
+        self.assertEqual(error['line'], 2)
+        self.assertIn('オブジェクト', error['error'])
+        self.assertFalse(Goals.objects.filter(user=self.other).exists())
+
+    def test_broken_files(self):
+        for content, name in [('{"goal_title": \n', 'goals.jsonl'), (b'goal_title\n\xff\xfe\n', 'goals.csv')]:
+            with self.subTest(name=name):
+                response = self.upload(content, name=name)
+                self.assertEqual(response.status_code, 400)
+                self.assertTrue(response.json()['errors'][0]['error'].startswith('読み込めません: '))
+
+    def test_unsupported_format(self):
+        self.assertEqual(self.upload('x', name='goals.txt').status_code, 400)
+        self.assertEqual(self.client.post(reverse('accounts:goals_import')).status_code, 400)
+
+
+class CardTemplateCheckTests(SimpleTestCase):
+    """manage.py checkでフォントが無いことを知らせる（最初のカードの描画で失敗させない）"""
+
+    def error_ids(self):
+        return [error.id for error in check_card_templates(None)]
+
+    def test_font_exists(self):
+        with override_settings(CARD_FONT_PATH=__file__):
+            self.assertEqual(self.error_ids(), [])
+
+    def test_missing_font(self):
+        with override_settings(CARD_FONT_PATH='/nonexistent/font.ttc'):
+            self.assertEqual(self.error_ids(), ['accounts.E002'])
+
+    def test_missing_layout_font(self):
+        layout = dict(CARD_TEMPLATES[DEFAULT_CARD_TEMPLATE], font='/nonexistent/font.ttc')
+        self.assertEqual(validate_layout('broken', layout), ['broken: フォント /nonexistent/font.ttc が見つかりません'])
+        self.assertEqual(validate_layout('ok', dict(layout, font=__file__)), [])
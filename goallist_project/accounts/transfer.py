@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .forms import GoalRegistForm, TaskForm
+from .models import Goals, Tasks
+
+
+# 夢リストの書き出し・読み込み。1行が「夢1件＋そのタスク1件」（タスクの無い夢はタスクの列が空）。
+# goal_refは書き出したときの夢のIDで、読み込み時に同じ夢のタスクをまとめるためだけに使う。
+COLUMNS = ['goal_ref', 'goal_title', 'goal_detail', 'goal_condition', 'task_title', 'task_priority', 'task_due', 'task_condition']
+EXPORT_CHUNK_SIZE = 2000 # DBから一度に受け取る行数
+IMPORT_BATCH_SIZE = 500 # bulk_createでまとめて入れる件数
+MAX_IMPORT_ROWS = 50000
+MAX_IMPORT_ERRORS = 20
+
+
+def export_rows(user):
+    """書き出す行を順に返す。DBからはEXPORT_CHUNK_SIZE行ずつ読むので、件数が多くてもメモリは増えない"""
+    goal_fields = ('id', 'goal_title', 'goal_detail', 'goal_condition')
+    for goal in Goals.objects.filter(user=user, tasks__isnull=True).order_by('id').only(*goal_fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [goal.id, goal.goal_title, goal.goal_detail, goal.goal_condition, '', '', '', '']
+    tasks = Tasks.objects.filter(goals__user=user).select_related('goals').only(
+        'task_title', 'task_priority', 'task_due', 'task_condition', *(f'goals__{f}' for f in goal_fields),
+    ).order_by('goals_id', 'task_priority', 'task_due', 'id')
+    for task in tasks.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        goal = task.goals
+        yield [goal.id, goal.goal_title, goal.goal_detail, goal.goal_condition,
+               task.task_title, task.task_priority, task.task_due.isoformat(), int(task.task_condition)]
+
+
+class Echo: # csv.writerの書き込み先。書いた1行をそのまま返す
+    def write(self, value):
+        return value
+
+
+def export_csv(user):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(COLUMNS) # BOM付きにしてExcelでも文字化けしないようにする
+    for row in export_rows(user):
+        yield writer.writerow(row)
+
+
+def export_jsonl(user):
+    for row in export_rows(user):
+        yield json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=str) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
+
+
+def parse_csv(text):
+    yield from csv.DictReader(text)
+
+
+def parse_jsonl(text):
+    for line in text:
+        if line.strip():
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('1行に1つのオブジェクト（{...}）を書いてください')
+            yield record
+
+
+IMPORT_FORMATS = {'csv': parse_csv, 'jsonl': parse_jsonl}
+
+
+class TransferError(Exception): # 読み込みを取りやめる。messagesは(行番号, 内容)のリスト
+    def __init__(self, messages):
+        super().__init__(messages)
+        self.messages = messages
+
+
+class GoalImporter:
+    """行を1つずつ受け取り、IMPORT_BATCH_SIZEごとにbulk_createする。
+    夢の上限はGoals.objects.bulk_createが一括で確保する（1件ごとに件数を数えない）"""
+
+    def __init__(self, user):
+        self.user = user
+        self.goals = {} # goal_ref -> 保存済み・保存待ちのGoals
+        self.pending_goals = []
+        self.pending_tasks = []
+        self.errors = []
+        self.goal_count = 0
+        self.task_count = 0
+
+    def error(self, line, message):
+        self.errors.append({'line': line, 'error': message})
+        if len(self.errors) >= MAX_IMPORT_ERRORS:
+            raise TransferError(self.errors)
+
+    def add(self, line, record):
+        record = {key: ('' if value is None else str(value)) for key, value in record.items() if key in COLUMNS}
+        ref = record.get('goal_ref') or f'line-{line}' # 参照が無ければ1行で1つの夢
+        goal = self.goals.get(ref)
+        if goal is None:
+            form = GoalRegistForm({'goal_title': record.get('goal_title', ''), 'goal_detail': record.get('goal_detail', '')})
+            if not form.is_valid():
+                return self.error(line, form.errors.get_json_data())
+            try:
+                condition = int(record.get('goal_condition') or 0)
+            except ValueError:
+                return self.error(line, {'goal_condition': '整数で指定してください'})
+            goal = self.goals[ref] = Goals(user=self.user, goal_condition=condition, **form.cleaned_data)
+            self.pending_goals.append(goal)
+        if record.get('task_title'):
+            form = TaskForm({key: record[key] for key in ('task_title', 'task_priority', 'task_due') if record.get(key)} | {
+                'task_condition': record.get('task_condition', '').lower() in ('1', 'true'),
+            })
+            if not form.is_valid():
+                return self.error(line, form.errors.get_json_data())
+            task = form.save(commit=False)
+            task.goals = goal
+            self.pending_tasks.append(task)
+        if len(self.pending_goals) + len(self.pending_tasks) >= IMPORT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.errors: # エラーがあれば全体を取り消すので、それ以降は保存しない
+            return
+        if self.pending_goals:
+            Goals.objects.bulk_create(self.pending_goals) # ここで上限を超えるとValidationError
+            self.goal_count += len(self.pending_goals)
+            self.pending_goals = []
+        if self.pending_tasks:
+            Tasks.objects.bulk_create(self.pending_tasks)
+            self.task_count += len(self.pending_tasks)
+            self.pending_tasks = []
+
+
+def import_goals(user, upload, fmt):
+    """アップロードされたファイルを少しずつ読みながら夢とタスクを追加する。
+    1件でも不正な行があるか、夢が上限を超えるなら何も追加しない。(夢の件数, タスクの件数)を返す"""
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='') # 全体を一度に読み込まない
+    importer = GoalImporter(user)
+    try:
+        with transaction.atomic():
+            line = 0
+            try:
+                for line, record in enumerate(IMPORT_FORMATS[fmt](text), start=1):
+                    if line > MAX_IMPORT_ROWS:
+                        raise TransferError([{'line': line, 'error': f'一度に読み込めるのは{MAX_IMPORT_ROWS}行までです'}])
+                    importer.add(line, record)
+            except (ValueError, csv.Error) as e: # 壊れたJSON・CSV、UTF-8でない文字
+                importer.error(line + 1, f'読み込めません: {e}')
+            importer.flush()
+            if importer.errors:
+                raise TransferError(importer.errors)
+    except ValidationError as e:
+        raise TransferError([{'line': None, 'error': e.messages}])
+    finally:
+        text.detach()
+    return importer.goal_count, importer.task_count
@@ -1,5 +1,7 @@
 from django.urls import path
-from .views import (HomeView, RegisterUserView, UserLoginView, UserLogoutView, UserEditView, GoalListView, GoalDetailView, GoalRegistView, GoalEditView, GoalDeleteView,PictGenerate, download_profile_picture)
+from . import async_views
+from .api import tasks_bulk, goals_list, goal_tasks, goals_export, goals_import, goals_search
+from .views import (HomeView, RegisterUserView, UserLoginView, UserLogoutView, UserEditView, GoalListView, GoalDetailView, GoalRegistView, GoalEditView, GoalDeleteView, GoalSearchView, PictGenerate, pict_status, download_profile_picture, picture_variant)
 
 
 app_name = 'accounts'
@@ -13,8 +15,22 @@ urlpatterns=[
     path('goal_detail/<int:pk>', GoalDetailView.as_view(), name='goal_detail'),
     path('goal_delete/<int:pk>', GoalDeleteView.as_view(), name='goal_delete'),
     path('goal_regist/', GoalRegistView.as_view(), name='goal_regist'),
+    path('goal_search/', GoalSearchView.as_view(), name='goal_search'),
     path('goal_edit/<int:pk>', GoalEditView.as_view(), name='goal_edit'),
     path('pict_generate/<int:pk>', PictGenerate.as_view(), name='pict_generate'),
+    path('pict_status/<str:job_id>', pict_status, name='pict_status'),
     path('download_profile_picture/<int:pk>', download_profile_picture, name='download_profile_picture'),
+    path('picture_variant/<int:width>/<str:fmt>/<path:name>', picture_variant, name='picture_variant'),
+    path('api/goals/<int:pk>/tasks/bulk', tasks_bulk, name='tasks_bulk'),
+    path('api/goals', goals_list, name='api_goals'),
+    path('api/goals/<int:pk>/tasks', goal_tasks, name='api_goal_tasks'),
+    path('api/goals/export.<str:fmt>', goals_export, name='goals_export'),
+    path('api/goals/import', goals_import, name='goals_import'),
+    path('api/goals/search', goals_search, name='api_goals_search'),
+    # ASGI用の非同期版（同じテンプレート・同じキャッシュを使う）
+    path('async/goal_list/<int:pk>', async_views.goal_list, name='async_goal_list'),
+    path('async/goal_detail/<int:pk>', async_views.goal_detail, name='async_goal_detail'),
+    path('async/download_profile_picture/<int:pk>', async_views.download_profile_picture, name='async_download_profile_picture'),
+    path('async/pict_generate/<int:pk>', async_views.pict_generate, name='async_pict_generate'),
     
 ]
\ No newline at end of file
@@ -0,0 +1,85 @@
+import io
+import posixpath
+import re
+from functools import lru_cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from .profiling import profile_span
+
+
+# 画像（Users.picture / 生成したカード）の縮小版。元ファイルと同じ場所に決まった名前で保存する
+#   picture/2024/05/01/foo.png -> picture/2024/05/01/foo.w320.webp, foo.clean.png（メタデータを除いた原寸）
+VARIANT_WIDTHS = (160, 320, 640)
+VARIANT_FORMATS = ('avif', 'webp', 'png') # srcsetに並べる順（対応していないブラウザは後ろへフォールバック）
+VARIANT_PREFIXES = ('picture/', 'cards/') # 縮小版を作ってよい元画像の置き場所
+
+VARIANT_RE = re.compile(r'\.(w\d+|clean)\.\w+$')
+
+PIL_FORMATS = {'avif': 'AVIF', 'webp': 'WEBP', 'png': 'PNG'}
+SAVE_OPTIONS = {'avif': {'quality': 60}, 'webp': {'quality': 80, 'method': 4}, 'png': {'optimize': True}}
+
+
+def get_variant_storage(): # 名前が決まっているので、上書きせず一時ファイルから置き換えるカード用のストレージを使う
+    return storages['cards']
+
+
+@lru_cache(maxsize=None)
+def supported_formats(): # このPillowで書き出せる形式だけを使う
+    from PIL import features
+    return tuple(fmt for fmt in VARIANT_FORMATS if fmt == 'png' or features.check(fmt))
+
+
+def variant_name(name, width=None, fmt='png'): # width=Noneはメタデータを除いた原寸のコピー
+    stem = posixpath.splitext(name)[0]
+    return f'{stem}.w{width}.{fmt}' if width else f'{stem}.clean.{fmt}'
+
+
+def is_variant_source(name):
+    return (
+        any(name.startswith(prefix) for prefix in VARIANT_PREFIXES)
+        and '..' not in name.split('/')
+        and not VARIANT_RE.search(name)
+    )
+
+
+def _encode(img, width, fmt):
+    with profile_span('image'):
+        return _resize_and_save(img, width, fmt)
+
+
+def _resize_and_save(img, width, fmt):
+    from PIL import Image
+    if width and img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format=PIL_FORMATS[fmt], **SAVE_OPTIONS[fmt]) # infoを渡さないのでEXIFなどは書き出されない
+    return buffer.getvalue()
+
+
+def _open(name):
+    from PIL import Image
+    with get_variant_storage().open(name, 'rb') as f:
+        img = Image.open(f)
+        img.load()
+    return img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+
+def ensure_variant(name, width, fmt): # 無ければ作って、縮小版のファイル名を返す
+    storage = get_variant_storage()
+    target = variant_name(name, width, fmt)
+    if not storage.exists(target):
+        storage.save(target, ContentFile(_encode(_open(name), width, fmt)))
+    return target
+
+
+def generate_variants(name): # すべての幅・形式とメタデータなしのコピーをまとめて作る（元画像は1回だけデコードする）
+    storage = get_variant_storage()
+    img = None
+    for width in VARIANT_WIDTHS + (None,):
+        for fmt in (supported_formats() if width else ('png',)):
+            target = variant_name(name, width, fmt)
+            if storage.exists(target):
+                continue
+            if img is None:
+                img = _open(name)
+            storage.save(target, ContentFile(_encode(img, width, fmt)))
@@ -1,6 +1,10 @@
 from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.db.models.query import QuerySet
-from django.http import HttpRequest
+from django.http import HttpRequest, Http404, JsonResponse
 from django.http.response import HttpResponse as HttpResponse
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
@@ -10,21 +14,23 @@ from django.views.generic.base import TemplateView, View
 from . import forms
 from .forms import RegistForm, UserLoginForm, UserEditForm, GoalRegistForm, GoalEditForm
 from django.contrib.auth import authenticate, logout
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.messages.views import SuccessMessageMixin
-from .models import Users, Goals, Tasks
+from .models import Users, Goals, Tasks, task_summary_annotations
 from django.shortcuts import render, redirect, get_object_or_404
-import cv2
-import numpy as np
-from PIL import ImageFont, ImageDraw, Image
-from django.contrib.auth.password_validation import validate_password
-from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.contrib import messages
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-import mimetypes
+from django.utils.functional import cached_property, SimpleLazyObject
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from .card_templates import CARD_TEMPLATES, DEFAULT_CARD_TEMPLATE, card_template_choices
+from .rendering import card_fields, card_name, get_card_storage
+from .jobs import submit_card, job_status, parse_job_id
+from .downloads import stream_field_file
+from .fragments import get_user_version, fragment_is_cached
+from .search import search_goals
+from .variants import VARIANT_WIDTHS, supported_formats, is_variant_source, get_variant_storage, ensure_variant
 
 
 class HomeView(TemplateView):
@@ -44,20 +50,7 @@ class RegisterUserView(CreateView):
     def form_valid(self, form):
         form.instance.created_at = datetime.now()
         form.instance.upload_at = datetime.now()
-        
-        # Form validation and password validation
-        cleaned_data = form.cleaned_data
-        username = cleaned_data.get('username')
-        address = cleaned_data.get('address')
-        password = cleaned_data.get('password')
-
-        user = Users(username=username, address=address)
-        try:
-            validate_password(password, user)
-        except ValidationError as e:
-            form.add_error('password', e.messages)
-            return self.form_invalid(form)
-        
+        # パスワードの検証はRegistForm.cleanで済んでいる
         messages.success(self.request, '登録に成功しました')
 
         return super().form_valid(form)
@@ -70,7 +63,7 @@ class UserLoginView(LoginView):
     def form_valid(self, form):
         remember = form.cleaned_data['remember']
         if remember:
-            self.request.session.set_expiry(1209600) #ログイン保持状態にチェックがあれば2週間(1209600)保持する
+            self.request.session.set_expiry(settings.SESSION_REMEMBER_AGE) #ログイン保持状態にチェックがあれば2週間(1209600)保持する
         return super().form_valid(form)
     
     def form_invalid(self, form):
@@ -101,28 +94,111 @@ class UserEditView(UpdateView, SuccessMessageMixin, LoginRequiredMixin): #ログ
 
 
 def download_profile_picture(request, pk):
-    user = Users.objects.get(pk=pk)
-    # プロフィール画像のパスを取得
-    profile_picture_path = user.picture.path
-    # ファイルのMIMEタイプを取得
-    content_type = mimetypes.guess_type(profile_picture_path)[0]
-    # ダウンロード用のレスポンスを作成
-    response = HttpResponse(default_storage.open(profile_picture_path), content_type=content_type)
-    # ダウンロード用のヘッダを設定
-    response['Content-Disposition'] = f'attachment; filename="{user.username}_profile_picture.{content_type.split("/")[1]}"'
-    return response
+    user = get_object_or_404(Users.objects.only('username', 'picture', 'upload_at'), pk=pk)
+    if not user.picture:
+        raise Http404('プロフィール画像がありません')
+    # ファイル全体をメモリに読み込まず、チャンクごとに送る
+    return stream_field_file(request, user.picture, user.upload_at, f'{user.username}_profile_picture')
+    
+    
+    
+def encode_cursor(goal): # 一覧の次ページの開始位置
+    return urlsafe_base64_encode(f'{goal.created_at.isoformat()}|{goal.pk}'.encode())
+
+
+def decode_cursor(cursor): # (created_at, id)。不正な値ならNone（先頭ページを表示）
+    if not cursor:
+        return None
+    try:
+        created_at, pk = urlsafe_base64_decode(cursor).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError:
+        return None
+
+
+def goal_page_queryset(user, cursor, page_size):
+    # 現在のユーザーが登録したゴールのみを取得するクエリを実行
+    # タスクの集計も同じクエリで行う（テンプレートでのN+1を防ぐ）
+    queryset = Goals.objects.filter(user=user).annotate(**task_summary_annotations()).order_by('-created_at', '-id')
+    cursor = decode_cursor(cursor)
+    if cursor is not None:
+        created_at, pk = cursor
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    return queryset[:page_size + 1] # 1件多く取って次のページがあるかを判定する
+
+
+def goal_detail_queryset(user):
+    return Goals.objects.filter(user=user).select_related('user').prefetch_related(
+        Prefetch('tasks_set', queryset=Tasks.objects.order_by('task_priority', 'task_due', 'id'))
+    )
+
+
+class GoalPage: # テンプレートで使われたときに初めてクエリを実行する（断片キャッシュが効けば実行されない）
     
+    def __init__(self, queryset, page_size):
+        self.queryset = queryset
+        self.page_size = page_size
     
+    @cached_property
+    def rows(self):
+        return list(self.queryset)
     
+    @property
+    def goals(self):
+        return self.rows[:self.page_size]
+    
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.rows[self.page_size - 1]) if len(self.rows) > self.page_size else None
+
+
+# 縮小版が無ければ作ってから、その画像へ転送する（2回目以降はテンプレートタグが直接URLを出す）
+def picture_variant(request, width, fmt, name):
+    if width not in VARIANT_WIDTHS or fmt not in supported_formats() or not is_variant_source(name):
+        raise Http404('画像が見つかりません')
+    storage = get_variant_storage()
+    if not storage.exists(name):
+        raise Http404('画像が見つかりません')
+    return redirect(storage.url(ensure_variant(name, width, fmt)))
+
+
 # 夢一覧画面作る
-class GoalListView(ListView, LoginRequiredMixin):
+class GoalListView(LoginRequiredMixin, ListView):
     template_name = 'goal_list.html'
     model = Goals
     context_object_name = 'goals'
     
+    paginate_by = None # OFFSETではなく(created_at, id)のキーセットでページを切る
+    page_size = 20
+    
+    def get_queryset(self):
+        return goal_page_queryset(self.request.user, self.request.GET.get('cursor'), self.page_size)
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page'] = GoalPage(context['goals'], self.page_size)
+        context['cursor'] = self.request.GET.get('cursor', '')
+        context['is_first_page'] = 'cursor' not in self.request.GET
+        context['fragment_version'] = get_user_version(self.request.user.pk)
+        return context
+
+
+# 夢の検索画面
+class GoalSearchView(LoginRequiredMixin, ListView):
+    template_name = 'goal_search.html'
+    context_object_name = 'goals'
+    max_results = 100
+    
     def get_queryset(self):
-        # 現在のユーザーが登録したゴールのみを取得するクエリを実行
-        return Goals.objects.filter(user=self.request.user)
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return Goals.objects.none()
+        return search_goals(self.request.user, query).annotate(**task_summary_annotations()).order_by('-created_at', '-id')[:self.max_results]
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '')
+        return context
 
 
 # 夢作成用画面作る（フォームあり）
@@ -136,10 +212,14 @@ class GoalRegistView(CreateView, LoginRequiredMixin):
         form.instance.user = self.request.user # 現在のユーザーを指定
         form.instance.created_at = datetime.now()
         form.instance.upload_at = datetime.now()
-        goal = form.save(commit=False)
-        goal.save()
+        try:
+            with transaction.atomic(): # 夢とタスクの書き込みをまとめ、検索用の文書の作り直しをコミット時の1回にする
+                response = super().form_valid(form) # 保存はここ（form.save()）の1回だけ
+        except ValidationError as error: # 夢の数が上限に達している（Goals.save）
+            form.add_error(None, error)
+            return self.form_invalid(form)
         messages.success(self.request, '登録に成功しました')
-        return super().form_valid(form)
+        return response
     
     def get_success_url(self):
         return reverse('accounts:goal_list', kwargs={'pk': self.object.pk})
@@ -149,6 +229,10 @@ class GoalDeleteView(LoginRequiredMixin, DeleteView):
     template_name = 'goal_delete.html'
     model = Goals
     
+    @transaction.atomic # 連鎖削除されるタスクごとの処理をコミット時にまとめる
+    def form_valid(self, form):
+        return super().form_valid(form)
+    
     def delete(self, request, *args, **kwargs):
         response = super().delete(request, *args, **kwargs)
         messages.success(self.request, '削除しました')
@@ -165,6 +249,7 @@ class GoalEditView(UpdateView, SuccessMessageMixin, LoginRequiredMixin):
     model = Goals
     form_class = GoalEditForm
     
+    @transaction.atomic
     def form_valid(self, form):
         form.instance.user = self.request.user # 現在のユーザーを指定
         form.instance.upload_at = datetime.now()
@@ -177,54 +262,59 @@ class GoalEditView(UpdateView, SuccessMessageMixin, LoginRequiredMixin):
 
 
 # 夢の個別画面つくる
-class GoalDetailView(View, LoginRequiredMixin):
+class GoalDetailView(LoginRequiredMixin, View):
     models = Goals
     queryset = Goals.objects.all()
     template_name = 'goal_detail.html'
     
     def get(self, request, pk, **kwargs):
-        context = {}
-        context["goal"] = Goals.objects.filter(id=pk).first()
-        obj = Goals.objects.filter(id=pk).first()
-        obj.save()
-        return render(request, "goal_detail.html", context)
+        # 表示するだけなので保存はしない（GETでUPDATEを発行しない）
+        queryset = goal_detail_queryset(request.user)
+        version = get_user_version(request.user.pk)
+        if fragment_is_cached('goal_detail', request.user.pk, version, pk):
+            # 描画済みの断片があれば夢は存在する。断片が消えていたときだけテンプレートの中で読み込む
+            goal = SimpleLazyObject(lambda: queryset.filter(pk=pk).first())
+        else:
+            goal = get_object_or_404(queryset, pk=pk)
+        context = {'goal': goal, 'goal_pk': pk, 'fragment_version': version, 'card_templates': card_template_choices()}
+        return render(request, self.template_name, context)
 
 
 # 画像生成画面つくる
-class PictGenerate(View, LoginRequiredMixin):
+class PictGenerate(LoginRequiredMixin, View):
     template_name = 'pict_generate.html'
 
-    def putText_japanese(self, img, text, point, size, color): # 日本語で描画できるようにする
-        font = ImageFont.truetype('/home/aonori103/fonts/UDDigiKyokashoN-R.ttc', size)
-        img_pil = Image.fromarray(img) # imgをndarrayからPILに変換
-        draw = ImageDraw.Draw(img_pil) # #drawインスタンス生成
-        draw.text(point, text, fill=color, font=font) # テキスト描画
-        return np.array(img_pil) # PILからndarrayに変換して返す
-
-
     def get(self, request, pk):
-        profile_goal = Goals.objects.get(pk=pk)
+        profile_goal = get_object_or_404(Goals.objects.select_related('user'), pk=pk, user=request.user) # 自分の夢のカードだけ作れる
         user_profile = profile_goal.user
-        image_file = '/home/aonori103/goallist_alpha/goallist_project/static/test.png'
-        img = cv2.imread(image_file)
-        img = self.putText_japanese(img, user_profile.username, (130, 150), 40, (25, 131, 255))
-        img = self.putText_japanese(img, user_profile.job, (140, 220), 25, (25, 131, 255))
-        img = self.putText_japanese(img, str(user_profile.birthday), (140, 260), 25, (25, 131, 255))
-        img = self.putText_japanese(img, user_profile.introduction, (140, 300), 25, (25, 131, 255))
-        img = self.putText_japanese(img, profile_goal.goal_title, (140, 340), 30, (25, 131, 255))
-        img = self.putText_japanese(img, profile_goal.goal_detail, (140, 380), 30, (25, 131, 255))
-
-    # 画像を保存するパスを指定
-        save_path = '/home/aonori103/goallist_alpha/goallist_project/static/kakouzumi.png'
-        cv2.imwrite(save_path, img)
-
-        # Usersモデルのインスタンスに画像を割り当てる
-        user_profile.picture.save('generated_image.png', ContentFile(open(save_path, 'rb').read()), save=True)
-
-    # テンプレートに渡すコンテキストを作成
-        context = {
-            'image_url': save_path.replace('/home/aonori103/goallist_alpha/goallist_project/static/', '/static/')
-        }
+        template = request.GET.get('template', DEFAULT_CARD_TEMPLATE)
+        if template not in CARD_TEMPLATES:
+            raise Http404('テンプレートが見つかりません')
+        fields = card_fields(user_profile, profile_goal)
+        card = card_name(fields, template)
+        # 入力が前回と同じなら保存済みのカードをそのまま使う（ユーザー情報や夢を編集するとハッシュが変わり作り直される）
+        if get_card_storage().exists(card):
+            # Usersモデルのインスタンスに画像を割り当てる
+            if user_profile.picture.name != card:
+                user_profile.picture.name = card
+                user_profile.save(update_fields=['picture', 'upload_at'])
+            context = {'image_url': user_profile.picture.url, 'picture': user_profile.picture}
+        else:
+            # 描画はワーカーに任せてすぐに返し、画面側で完成を待つ
+            job_id = submit_card(user_profile.pk, fields, template)
+            context = {'status_url': reverse('accounts:pict_status', kwargs={'job_id': job_id})}
 
         # テンプレートをレンダリング
-        return render(request, self.template_name, context)
\ No newline at end of file
+        return render(request, self.template_name, context)
+
+
+# 画像生成の進み具合を返す
+@login_required
+def pict_status(request, job_id):
+    parsed = parse_job_id(job_id)
+    if parsed is None or parsed[0] != request.user.pk: # 他のユーザーのジョブは見せない
+        raise Http404('ジョブが見つかりません')
+    status = job_status(job_id)
+    if status is None:
+        raise Http404('ジョブが見つかりません')
+    return JsonResponse(status)
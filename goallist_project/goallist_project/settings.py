@@ -53,11 +53,41 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accounts.profiling.RequestProfilingMiddleware', #REQUEST_PROFILING=True のときだけ動く
 ]
 
+# リクエストごとの処理時間の内訳をログに出す（manage.py profile_report で集計）
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING') == '1'
+REQUEST_PROFILING_LOG = os.environ.get('REQUEST_PROFILING_LOG', os.path.join(BASE_DIR, 'request_profile.jsonl'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'request_profile': {
+            'class': 'logging.FileHandler',
+            'filename': REQUEST_PROFILING_LOG,
+            'formatter': 'message',
+            'encoding': 'utf-8',
+            'delay': True, #記録するまでファイルを作らない
+        },
+    },
+    'loggers': {
+        'accounts.profiling': {'handlers': ['request_profile'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 AUTHENTICATION_BACKENDS = ( # ログイン処理時の認証設定
-    "django.contrib.auth.backends.ModelBackend", # デフォルトの認証
+    "accounts.backends.CachedModelBackend", # デフォルトの認証に、ログイン中のユーザーの短時間キャッシュを足したもの
+    # 以前のセッションにはこのパスが保存されているので、残しておかないと全員がログアウトされる。
+    # ログインには使われない（CachedModelBackendで失敗したらそこで止まる）。SESSION_REMEMBER_AGE（2週間）が過ぎたら外してよい
+    "django.contrib.auth.backends.ModelBackend",
 )
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 30)) #ログイン中のユーザーをプロセス内に持つ秒数（0で無効）
+AUTH_USER_CACHE_SIZE = 10000
 
 ROOT_URLCONF = 'goallist_project.urls'
 
@@ -83,23 +113,94 @@ WSGI_APPLICATION = 'goallist_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql で PostgreSQL を使う（psycopg と psycopg-pool は requirements.txt に入っている）
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'goallist'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)), #接続を使い回す秒数
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('DB_POOL'): #psycopgのコネクションプール（Django 5.1以降の機能）
+        DATABASES['default']['CONN_MAX_AGE'] = 0 #プールを使うときは0にする必要がある
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                'timeout': 20, #ロック待ちの秒数（busy_timeout）
+                # トランザクションの開始時に書き込みのロックを取る（DEFERREDだと、読んだ後の書き込みがロック待ちをせずに「database is locked」で失敗する）
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
+
+# SQLiteの接続ごとに実行するPRAGMA（accounts.signalsで適用）。WALにすると読み込みが書き込みを待たなくなる
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=20000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA mmap_size=134217728',
+]
+
+
+# Cache
+# 画面の断片キャッシュ（accounts.fragments）。複数ワーカーで動かすときは file か db にする（locmemはプロセスごと）
+FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'file')
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments'},
+    'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(BASE_DIR, 'cache', 'fragments')},
+    'db': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'fragment_cache'}, #manage.py createcachetable が必要
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': dict(FRAGMENT_CACHE_BACKENDS[FRAGMENT_CACHE_BACKEND], TIMEOUT=600, OPTIONS={'MAX_ENTRIES': 10000}),
 }
 
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
-PASSWORD_HASHERS = [
-    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
-    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
-    "django.contrib.auth.hashers.Argon2PasswordHasher",
-    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+# 新しいパスワードは先頭のハッシュ方式で保存する。残りは既存のハッシュの照合用（ログイン時に先頭の方式へハッシュし直される）
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'pbkdf2') # pbkdf2 / argon2（manage.py bench_hashers で比べて選ぶ）
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': "accounts.hashers.TunedPBKDF2PasswordHasher",
+    'argon2': "accounts.hashers.TunedArgon2PasswordHasher",
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for hasher in (
+        "accounts.hashers.TunedPBKDF2PasswordHasher",
+        "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+        "accounts.hashers.TunedArgon2PasswordHasher",
+        "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    ) if hasher != PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]
 ]
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 0)) or None #Noneのときは Django の既定値
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 102400)) #KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 8))
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -136,10 +237,42 @@ STATIC_URL = '/static/'
 # STATICFILES_DIRS = (STATIC_DIR,)
 STATIC_ROOT =  os.path.join(BASE_DIR, "static")
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media') #アップロード・生成した画像の保存先
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'cards': {'BACKEND': 'accounts.storage.CardStorage'}, #生成したプロフィール画像（内容のハッシュで保存）
+}
+
+PICTURE_SENDFILE = os.environ.get('PICTURE_SENDFILE') or None #'x-sendfile'(Apache) / 'x-accel-redirect'(nginx) を指定するとプロキシにファイル送信を任せる
+PICTURE_SENDFILE_PREFIX = os.environ.get('PICTURE_SENDFILE_PREFIX', '/protected-media/') #x-accel-redirect用のinternal location
+
+CARD_FONT_PATH = os.environ.get('CARD_FONT_PATH', os.path.join(BASE_DIR, 'fonts', 'UDDigiKyokashoN-R.ttc')) #プロフィール画像に使う日本語フォント（無ければmanage.py checkでエラー）
+CARD_WORKERS = int(os.environ.get('CARD_WORKERS', 2)) #プロフィール画像を生成するワーカースレッド数
+
+# メール（send_task_reminders）。手元では EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend などで確認できる
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', os.path.join(BASE_DIR, 'sent_emails'))
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@goallist.example')
+TASK_REMINDER_DAYS = int(os.environ.get('TASK_REMINDER_DAYS', 1)) #期限が何日後までのタスクをお知らせするか
+TASK_REMINDER_OVERDUE_DAYS = int(os.environ.get('TASK_REMINDER_OVERDUE_DAYS', 7)) #期限を過ぎて何日までのタスクをお知らせするか
+
 LOGIN_URL = '/accounts/user_login' #ログインしてないときにlogin_requiredのViewを開いたときのリダイレクト先View
 LOGIN_REDIRECT_URL = '/accounts/home' #LoginViewで遷移先が指定されていないときに遷移するURL
 LOGOUT_REDIRECT_URL = '/accounts/user_login' #LogoutViewで遷移先が指定されていないときに遷移するURL
 SESSION_COOKIE_AGE = 259200 #3日間ログイン状態保持
+SESSION_REMEMBER_AGE = 1209600 #ログイン保持状態にチェックがあれば2週間保持する
+
+# db: 毎回DBから読む / cached_db: キャッシュから読み、無ければDB / signed_cookies: Cookieに署名して持たせる（DBを使わない）
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'db')
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'accounts.sessions', #set_expiry()の期限を守るようにしたもの
+}
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -155,7 +288,7 @@ CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
 
 from django.core.management.utils import get_random_secret_key
-SECRET_KEY = get_random_secret_key()
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY') or get_random_secret_key() #signed_cookiesのセッションは全プロセスで同じ鍵が必要
 
 try:
     from .local_settings import *